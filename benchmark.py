@@ -0,0 +1,225 @@
+import kdtree
+import quadtree
+import rangetree
+import random
+import time
+from tools import *
+
+"""This python script measures the time performance
+of the data structures' build and query operations.
+
+Every benchmark function prints its measurements so that
+different configurations of the trees can be compared
+"""
+
+def random_datapoints(n, dimensions=2, seed=0):
+    rng = random.Random(seed)
+    return [Datapoint([rng.random() for _ in range(dimensions)], i) for i in range(n)]
+
+def random_regions(q, dimensions=2, width=0.05, seed=1):
+    rng = random.Random(seed)
+    regions = []
+    for _ in range(q):
+        region = []
+        for _ in range(dimensions):
+            low = rng.random()*(1 - width)
+            region.append([low, low + width])
+        regions.append(region)
+    return regions
+
+def timeit(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def bench_range_search_many(n=100000, q=10000, dimensions=2, width=0.05):
+    """Compares the throughput of KDTree.range_search_many
+    with a loop of single KDTree.range_search queries
+    """
+
+    tree = kdtree.KDTree(random_datapoints(n, dimensions))
+    regions = random_regions(q, dimensions, width)
+
+    loop_time, loop_results = timeit(lambda: [tree.range_search(region) for region in regions])
+    batch_time, batch_results = timeit(tree.range_search_many, regions)
+    assert [len(r) for r in loop_results] == [len(r) for r in batch_results]
+
+    print("KD tree range search, n = {}, queries = {}, d = {}".format(n, q, dimensions))
+    print("single query loop: {:.3f}s ({:.0f} queries/s)".format(loop_time, q/loop_time))
+    print("range_search_many: {:.3f}s ({:.0f} queries/s)".format(batch_time, q/batch_time))
+
+def bench_leaf_size(n=20000, q=1000, dimensions=2, width=0.05, leaf_sizes=(1, 4, 16, 32, 64)):
+    """Measures the number of nodes, the build time and the range search
+    latency of KDTree and RangeTree for different bucket sizes
+    """
+
+    datapoints = random_datapoints(n, dimensions)
+    regions = random_regions(q, dimensions, width)
+
+    print("Bucket leafs, n = {}, queries = {}, d = {}".format(n, q, dimensions))
+    for name, tree_class in [("KD tree", kdtree.KDTree), ("Range tree", rangetree.RangeTree)]:
+        for leaf_size in leaf_sizes:
+            build_time, tree = timeit(tree_class, datapoints, leaf_size=leaf_size)
+            query_time, _ = timeit(lambda: [tree.range_search(region) for region in regions])
+            print("{} leaf_size = {:>3}: nodes = {:>8}, build = {:.3f}s, query = {:.3f}ms".format(
+                name, leaf_size, tree.size(), build_time, 1000*query_time/q))
+
+def bench_parallel_build(n=200000, dimensions=3, worker_counts=(1, 2, 4, 8, 16, 32)):
+    """Measures the speedup of the KDTree build for different numbers of worker processes
+    """
+
+    datapoints = random_datapoints(n, dimensions)
+
+    print("KD tree parallel build, n = {}, d = {}".format(n, dimensions))
+    serial_time = None
+    for workers in worker_counts:
+        build_time, _ = timeit(kdtree.KDTree, datapoints, workers=workers)
+        serial_time = serial_time or build_time
+        print("workers = {:>2}: build = {:.3f}s, speedup = {:.2f}".format(
+            workers, build_time, serial_time/build_time))
+
+def bench_cascading(n=5000, q=1000, dimensions=3, width=0.2):
+    """Compares the range search latency of RangeTree
+    with and without fractional cascading
+    """
+
+    datapoints = random_datapoints(n, dimensions)
+    regions = random_regions(q, dimensions, width)
+
+    print("Range tree fractional cascading, n = {}, queries = {}, d = {}".format(n, q, dimensions))
+    for cascading in [False, True]:
+        build_time, tree = timeit(rangetree.RangeTree, datapoints, cascading=cascading)
+        query_time, _ = timeit(lambda: [tree.range_search(region) for region in regions])
+        print("cascading = {:>5}: build = {:.3f}s, query = {:.3f}ms".format(
+            str(cascading), build_time, 1000*query_time/q))
+
+def bench_memory(sizes=(1000, 2000, 4000, 8000), q=1000, dimensions=3, width=0.2):
+    """Compares the number of nodes, the memory usage and the range search
+    latency of RangeTree with associated trees and with compact associated arrays
+    """
+
+    regions = random_regions(q, dimensions, width)
+
+    print("Range tree memory, queries = {}, d = {}".format(q, dimensions))
+    for n in sizes:
+        datapoints = random_datapoints(n, dimensions)
+        for compact in [False, True]:
+            tree = rangetree.RangeTree(datapoints, compact=compact)
+            query_time, _ = timeit(lambda: [tree.range_search(region) for region in regions])
+            print("n = {:>6}, compact = {:>5}: nodes = {:>9}, memory = {:.1f}MB, query = {:.3f}ms".format(
+                n, str(compact), tree.size(), tree.memory_usage()/2**20, 1000*query_time/q))
+
+def bench_lazy(n=5000, q=1000, dimensions=3, width=0.05, memory_budget=2**24):
+    """Compares the build time, the query latency and the memory usage 
+    of an eager RangeTree and of a lazy RangeTree with a memory budget
+    """
+
+    datapoints = random_datapoints(n, dimensions)
+    regions = random_regions(q, dimensions, width)
+
+    print("Range tree lazy associated trees, n = {}, queries = {}, d = {}".format(n, q, dimensions))
+    for lazy in [False, True]:
+        build_time, tree = timeit(rangetree.RangeTree, datapoints, lazy=lazy, memory_budget=memory_budget)
+        query_time, _ = timeit(lambda: [tree.range_search(region) for region in regions])
+        print("lazy = {:>5}: build = {:.3f}s, query = {:.3f}ms, memory = {:.1f}MB".format(
+            str(lazy), build_time, 1000*query_time/q, tree.memory_usage()/2**20))
+        if lazy:
+            print("hits = {}, builds = {}, evictions = {}".format(tree.hits, tree.builds, tree.evictions))
+
+def bench_dynamic(n=5000, q=1000, dimensions=2, width=0.05, updates=5000, seed=2):
+    """Measures the amortized insert and delete time of DynamicRangeTree and 
+    compares its range search and range count latency with a RangeTree built 
+    with the same datapoints. A random sequence of deletes and inserts, that 
+    also inserts again deleted datapoints, is checked against the rebuilt RangeTree
+    """
+
+    datapoints = random_datapoints(n, dimensions)
+    regions = random_regions(q, dimensions, width)
+    rng = random.Random(seed)
+
+    print("Dynamic range tree, n = {}, queries = {}, d = {}".format(n, q, dimensions))
+    tree = rangetree.DynamicRangeTree()
+    insert_time, _ = timeit(lambda: [tree.insert(dp) for dp in datapoints])
+    print("insert: {:.3f}ms per datapoint, blocks = {}".format(
+        1000*insert_time/n, sum(1 for block in tree.blocks if block is not None)))
+
+    live = set(datapoints)
+    def update():
+        for _ in range(updates):
+            dp = rng.choice(datapoints)
+            if dp in live:
+                tree.delete(dp.vector)
+                live.remove(dp)
+            else:
+                tree.insert(dp)
+                live.add(dp)
+    update_time, _ = timeit(update)
+    print("delete/insert: {:.3f}ms per update, live = {}".format(1000*update_time/updates, len(tree)))
+
+    static = rangetree.RangeTree(list(live))
+    for region in regions[:100]:
+        expected = sorted(leaf.datapoint.id for leaf in static.range_search(region))
+        assert sorted(leaf.datapoint.id for leaf in tree.range_search(region)) == expected
+        assert tree.range_count(region) == len(expected)
+    assert len(tree) == len(live)
+
+    for name, searched in [("dynamic", tree), ("static", static)]:
+        query_time, _ = timeit(lambda: [searched.range_search(region) for region in regions])
+        count_time, _ = timeit(lambda: [searched.range_count(region) for region in regions])
+        print("{} query = {:.3f}ms, count = {:.3f}ms".format(name, 1000*query_time/q, 1000*count_time/q))
+
+def bench_linear_quadtree(n=100000, q=1000, width=0.05):
+    """Compares the build time and the range search latency 
+    of QuadTree and of the bulk loaded LinearQuadTree
+    """
+
+    datapoints = random_datapoints(n, 2)
+    boundaries = [Rect((x1 + x2)/2, (y1 + y2)/2, x2 - x1, y2 - y1) 
+                  for (x1, x2), (y1, y2) in random_regions(q, 2, width)]
+    boundary = Rect(0.5, 0.5, 1, 1)
+
+    print("Quad tree bulk loading, n = {}, queries = {}".format(n, q))
+    for name, tree_class in [("QuadTree", quadtree.QuadTree), ("LinearQuadTree", quadtree.LinearQuadTree)]:
+        build_time, tree = timeit(tree_class, boundary, datapoints)
+        query_time, _ = timeit(lambda: [tree.range_search(b) for b in boundaries])
+        print("{:>14}: build = {:.3f}s, query = {:.3f}ms, leafs = {}".format(
+            name, build_time, 1000*query_time/q, tree.size()))
+
+def bench_orthtree(n=20000, q=1000, dimensions=3, width=0.1):
+    """Compares the build time and the range search latency 
+    of OrthTree with KDTree and RangeTree on the same regions
+    """
+
+    datapoints = random_datapoints(n, dimensions)
+    regions = random_regions(q, dimensions, width)
+
+    print("Orthant tree, n = {}, queries = {}, d = {}".format(n, q, dimensions))
+    builders = [("KD tree", lambda: kdtree.KDTree(datapoints)), 
+                ("Range tree", lambda: rangetree.RangeTree(datapoints)),
+                ("Orthant tree", lambda: quadtree.OrthTree(calc_mbr(datapoints), datapoints))]
+    for name, builder in builders:
+        build_time, tree = timeit(builder)
+        query_time, _ = timeit(lambda: [tree.range_search(region) for region in regions])
+        print("{:>12}: build = {:.3f}s, query = {:.3f}ms".format(name, build_time, 1000*query_time/q))
+
+if __name__ == "__main__":
+    test_bench = "range_search_many" #Options are 'range_search_many', 'leaf_size', 'parallel_build', 'cascading', 'memory', 'lazy', 'dynamic', 'linear_quadtree', 'orthtree'
+
+    if test_bench == "range_search_many":
+        bench_range_search_many()
+    elif test_bench == "leaf_size":
+        bench_leaf_size()
+    elif test_bench == "parallel_build":
+        bench_parallel_build()
+    elif test_bench == "cascading":
+        bench_cascading()
+    elif test_bench == "memory":
+        bench_memory()
+    elif test_bench == "lazy":
+        bench_lazy()
+    elif test_bench == "dynamic":
+        bench_dynamic()
+    elif test_bench == "linear_quadtree":
+        bench_linear_quadtree()
+    elif test_bench == "orthtree":
+        bench_orthtree()
@@ -1,4 +1,9 @@
 from tools import *
+import numpy as np
+import heapq
+import json
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 class KDTree():
     """N-Dimensional k-d tree data structure
@@ -6,35 +11,265 @@ class KDTree():
     :param datapoints: The datapoints to generate the tree. 
     If None creates an empty tree, defaults to None
     :type datapoints: Datapoint, optional
+    :param alpha: The balance factor of insert() and delete(). A subtree is 
+    rebuilt when one child has more than alpha of its datapoints, defaults to 0.7
+    :type alpha: float, optional
+    :param leaf_size: The maximum number of datapoints in a bucket leaf. 
+    Nodes with that many datapoints or less are not split, defaults to 1
+    :type leaf_size: int, optional
+    :param aggregate: If True every node keeps the aggregates of its 
+    datapoints' payloads for range_aggregate(), defaults to False
+    :type aggregate: bool, optional
+    :param workers: The number of processes that build the tree, defaults to 1
+    :type workers: int, optional
+    :param index: If True the tree keeps a PointIndex of its datapoints
+    for O(1) lookup() by coordinates, defaults to False
+    :type index: bool, optional
     """
-    def __init__(self, datapoints = None):
+    def __init__(self, datapoints = None, alpha = 0.7, leaf_size = 1, aggregate = False, workers = 1, index = False):
         self.dimensions = len(datapoints[0].vector) if datapoints else 1
         self.total_region = calc_mbr(datapoints) if datapoints else None
-        self.root = self.build(datapoints)
+        self.alpha = alpha
+        self.leaf_size = max(1, leaf_size)
+        self.aggregate = aggregate
+        self.root = self.build(datapoints, workers = workers)
+        self.max_count = self.root.count if self.root else 0
+        self.index = PointIndex(datapoints) if index else None
 
-    def build(self, datapoints: Datapoint = None, depth = 0) -> Node:
+    def build(self, datapoints: Datapoint = None, depth = 0, workers = 1) -> Node:
+        """Builds the tree/subtree that stores the datapoints.
+        Every axis is sorted once, the first time a node splits on it,
+        and the nodes partition the sorted index lists of their parent
+        so the build takes O(n log n) time for a fixed number of dimensions.
+        With more than one worker the top levels are split by this process
+        with NumPy and the independent subtrees below them are built by a 
+        process pool. The subtrees come back as arrays and their nodes 
+        are created only when a query or an update first visits them
+
+        :param datapoints: The datapoints to store in the tree/subtree, defaults to None
+        :type datapoints: Datapoint, optional
+        :param depth: The depth of the subtree's root. 
+        It selects the splitting axis, defaults to 0
+        :type depth: int, optional
+        :param workers: The number of processes that build the tree, defaults to 1
+        :type workers: int, optional
+        :return: Returns the root/subroot node of the new tree/subtree
+        :rtype: Node
+        """
         # We assume all datapoints have different positions 
         if datapoints == None or len(datapoints) == 0:
             return None
 
+        if workers <= 1:
+            in_left = [False]*len(datapoints)
+            return self._build(datapoints, {}, list(range(len(datapoints))), in_left, depth)
+
+        # Split the top levels here and leave the subtrees below them to the workers
+        coords = np.array([dp.vector for dp in datapoints])
+        tasks = []
+        top = []
+        task_depth = depth + math.ceil(math.log2(workers)) + 2
+        root = self._build_top(datapoints, coords, np.arange(len(datapoints)), depth, task_depth, tasks, top)
+        if tasks:
+            self._build_tasks(datapoints, coords, tasks, task_depth, workers)
+
+        # Update the annotations of the top levels now that their subtrees exist
+        for node in top:
+            self._annotate(node)
+        return root
+
+    def _build_top(self, datapoints, coords, indexes, depth, task_depth, tasks, top) -> Node:
+        """Builds the nodes above task_depth with the same splits as _build(). 
+        The datapoints of a node are split with NumPy on the coordinates array. 
+        The children at task_depth that are not leafs are added to tasks 
+        as (parent node, child attribute, indexes of the child's datapoints)
+
+        :param datapoints: All the datapoints of the tree that is built
+        :type datapoints: list
+        :param coords: The coordinates array of the datapoints
+        :type coords: numpy.ndarray
+        :param indexes: The indexes of this node's datapoints
+        :type indexes: numpy.ndarray
+        :param depth: The depth of the node
+        :type depth: int
+        :param task_depth: The depth of the subtrees that the workers build
+        :type task_depth: int
+        :param tasks: The list where the subtrees of the workers are added
+        :type tasks: list
+        :param top: The list where the internal nodes are added in postorder
+        :type top: list
+        :return: Returns the node
+        :rtype: Node
+        """
+
         axis = depth%self.dimensions
+        if len(indexes) <= self.leaf_size:
+            return self._build(datapoints, {}, indexes.tolist(), None, depth)
+
+        values = coords[indexes, axis]
+        unique = np.unique(values)
+        nodevalue = unique[(len(unique)-1)//2]
+        in_left = values <= nodevalue
+
+        node = Node(nodevalue.item(), axis)
+        for side, child_indexes in [('left_child', indexes[in_left]), ('right_child', indexes[~in_left])]:
+            if len(child_indexes) == 0:
+                continue
+            if depth + 1 >= task_depth and len(child_indexes) > self.leaf_size:
+                tasks.append((node, side, child_indexes))
+            else:
+                setattr(node, side, self._build_top(datapoints, coords, child_indexes, depth + 1, task_depth, tasks, top))
+        top.append(node)
+        return node
+
+    def _build_tasks(self, datapoints, coords, tasks, depth, workers):
+        """Builds the subtrees of the tasks in a process pool.
+        The workers read the coordinates from a shared memory block
+        and return their subtrees encoded as arrays, that are attached
+        to their parent nodes as LazyNodes
+
+        :param datapoints: All the datapoints of the tree that is built
+        :type datapoints: list
+        :param coords: The coordinates array of the datapoints
+        :type coords: numpy.ndarray
+        :param tasks: The parent nodes, their child attributes and the indexes of the subtrees' datapoints
+        :type tasks: list
+        :param depth: The depth of the subtrees' roots
+        :type depth: int
+        :param workers: The number of processes
+        :type workers: int
+        """
+
+        payloads = None
+        if self.aggregate:
+            payloads = np.array([np.nan if dp.payload is None else dp.payload for dp in datapoints], dtype=float)
+
+        shm = shared_memory.SharedMemory(create=True, size=coords.nbytes)
+        try:
+            np.ndarray(coords.shape, dtype=coords.dtype, buffer=shm.buf)[:] = coords
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_build_subtree, shm.name, coords.shape, coords.dtype, indexes, 
+                    None if payloads is None else payloads[indexes], depth, self.leaf_size) 
+                    for _, _, indexes in tasks]
+                for (parent, side, _), future in zip(tasks, futures):
+                    setattr(parent, side, LazyNode(future.result(), datapoints))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def encode(self, node: Node) -> dict:
+        """Encodes the subtree of the node as arrays in preorder. For every node
+        there is its value, its axis, the positions of its children or -1, 
+        the range start:end of the datapoint ids of its leafs in the ids array
+        and, if the tree keeps aggregates, the aggregates of its payloads, 
+        with nan for a missing min or max. The ids are the leafs' datapoint ids
 
-        values = list(set([datapoint.vector[axis] for datapoint in datapoints]))
-        values = sorted(values)
-        
-        mid = (len(values)-1)//2
-        nodevalue = values[mid]
+        :param node: The root/subroot node of the subtree
+        :type node: Node
+        :return: The encoded subtree
+        :rtype: dict
+        """
 
-        leftpoints = [dp for dp in datapoints if dp.vector[axis] <= nodevalue]
-        rightpoints = [dp for dp in datapoints if dp not in leftpoints]
+        nodes = list(iter_nodes(node))
+        positions = {id(n): i for i, n in enumerate(nodes)}
+        children = [[positions[id(child)] if child else -1 for child in [n.left_child, n.right_child]] for n in nodes]
+
+        # The datapoints of a node's leafs follow the node in preorder
+        starts = []
+        ids = []
+        for n in nodes:
+            starts.append(len(ids))
+            if n.is_leaf():
+                ids += [leaf.datapoint.id for leaf in leaf_nodes(n)]
+
+        encoded = {'values': np.array([n.value for n in nodes]), 
+                   'axes': np.array([n.axis for n in nodes], dtype=np.int16),
+                   'children': np.array(children, dtype=np.int64).reshape(-1, 2),
+                   'starts': np.array(starts, dtype=np.int64), 
+                   'counts': np.array([n.count for n in nodes], dtype=np.int64),
+                   'ids': np.array(ids, dtype=np.int64)}
+        if self.aggregate:
+            for key in ['n', 'sum', 'min', 'max']:
+                encoded[key] = np.array([np.nan if n.aggregates[key] is None else n.aggregates[key] for n in nodes], dtype=float)
+        return encoded
+
+    def _build(self, datapoints, orders, indexes, in_left, depth) -> Node:
+        """Called internally by build() for every node of the new tree
+
+        :param datapoints: All the datapoints of the tree that is built
+        :type datapoints: list
+        :param orders: For every axis that is already sorted the
+        indexes of this node's datapoints sorted by that axis
+        :type orders: dict
+        :param indexes: The indexes of this node's datapoints
+        :type indexes: list
+        :param in_left: Scratch list that marks the datapoints
+        that go to the left child
+        :type in_left: list
+        :param depth: The depth of the node
+        :type depth: int
+        :return: Returns the node
+        :rtype: Node
+        """
+
+        axis = depth%self.dimensions
+
+        if len(indexes) == 1:
+            datapoint = datapoints[indexes[0]]
+            return self._annotate(Node(datapoint.vector[axis], axis, datapoint = datapoint))
+
+        if len(indexes) <= self.leaf_size:
+            bucket = [datapoints[i] for i in indexes]
+            return self._annotate(Node(max(dp.vector[axis] for dp in bucket), axis, datapoints = bucket))
+
+        if axis not in orders:
+            orders[axis] = sorted(indexes, key = lambda i: datapoints[i].vector[axis])
+        order = orders[axis]
+
+        values = [datapoints[i].vector[axis] for i in order]
+        starts = [0] + [k for k in range(1, len(values)) if values[k] != values[k-1]]
+        mid = (len(starts)-1)//2
+        nodevalue = values[starts[mid]]
+        split = starts[mid+1] if mid+1 < len(starts) else len(values)
+
+        for k in range(len(order)):
+            in_left[order[k]] = k < split
+
+        leftorders = {}
+        rightorders = {}
+        for ax, ax_order in orders.items():
+            if ax == axis:
+                leftorders[ax] = ax_order[:split]
+                rightorders[ax] = ax_order[split:]
+            else:
+                leftorders[ax] = [i for i in ax_order if in_left[i]]
+                rightorders[ax] = [i for i in ax_order if not in_left[i]]
 
         node = Node(nodevalue, axis)
-        if len(datapoints) == 1:
-            node.datapoint=datapoints[0]
-        else:
-            node.left_child = self.build(leftpoints, depth = depth + 1)
-            node.right_child = self.build(rightpoints, depth = depth + 1)
-            
+        node.left_child = self._build(datapoints, leftorders, leftorders[axis], in_left, depth + 1)
+        if split < len(order):
+            node.right_child = self._build(datapoints, rightorders, rightorders[axis], in_left, depth + 1)
+        return self._annotate(node)
+
+    def _annotate(self, node: Node) -> Node:
+        """Updates the cached count and payload aggregates of the node
+        from its children or, for a leaf, from its datapoints
+
+        :param node: The node to update
+        :type node: Node
+        :return: Returns the node
+        :rtype: Node
+        """
+
+        if node.is_leaf():
+            if self.aggregate:
+                node.aggregates = aggregate_payloads([leaf.datapoint for leaf in leaf_nodes(node)])
+            return node
+
+        children = [child for child in [node.left_child, node.right_child] if child]
+        node.count = sum(child.count for child in children)
+        if self.aggregate:
+            node.aggregates = merge_aggregates([child.aggregates for child in children])
         return node
 
     def search(self, point, node: Node = None):
@@ -44,48 +279,431 @@ class KDTree():
         if node is None:
             node = self.root
 
-        value = point[node.axis]
+        while node:
+            if point[node.axis] > node.value:
+                node = node.right_child
+            elif node.left_child:
+                node = node.left_child
+            else:
+                for leaf in leaf_nodes(node) if node.is_leaf() else []:
+                    if leaf.datapoint.vector == point:
+                        return leaf
+                return None
 
-        result = None
-        if value <= node.value:
-            if node.left_child:
-                result = self.search(point, node.left_child)
-            elif node.is_leaf():
-                if node.datapoint.vector == point:
-                    result = node
-        else:
-            if node.right_child:
-                result = self.search(point, node.right_child)
+        return None
 
-        return result
+    def lookup(self, point) -> Datapoint:
+        """Finds the datapoint with the given coordinates. It takes O(1) 
+        time with the tree's PointIndex or else it searches the tree
+
+        :param point: The coordinates of the datapoint
+        :type point: list
+        :return: The datapoint or None if it is not in the tree
+        :rtype: Datapoint
+        """
+
+        if self.index is not None:
+            return self.index.get(point)
+        leaf = self.search(point)
+        return leaf.datapoint if leaf else None
+
+    def iter_range(self, s_region: list, node: Node = None, region = None):
+        """Yields the leaf nodes that are in the hyperrectangle s_region.
+        The tree is walked with an explicit stack and the results are
+        produced lazily, in the same order as range_search returns them
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :param node: The root/subroot from where to start the search.
+        If None provided it starts from the tree's root, defaults to None
+        :type node: Node, optional
+        :param region: The region of the node. If None provided
+        the total region of the tree is used, defaults to None
+        :type region: list, optional
+        :return: A generator of the resulting nodes of the range search
+        :rtype: generator
+        """
 
-    def range_search(self, s_region: list, node: Node = None, region = None):
         if self.root is None:
-            return []
-        
+            return
+
         if node is None:
             node = self.root
 
         if region is None:
             region = self.total_region
-        
-        results = []
 
-        if node.is_leaf():
-            if node.datapoint.in_range(s_region):
-                results.append(node)
-        else:
-            if contained(region, s_region):
-                [results.append(l) for l in extract_leafs(node)]
+        stack = [(node, region)]
+        while stack:
+            node, region = stack.pop()
+
+            if node.is_leaf():
+                yield from leaf_nodes(node, s_region)
+            elif contained(region, s_region):
+                yield from iter_leafs(node)
             else:
                 lc_region, rc_region = KDTree.bisect(region, node.axis, node.value)
-                if intersects(lc_region, s_region):
-                    results += self.range_search(s_region, node.left_child, lc_region)
-                if intersects(rc_region, s_region):
-                    results += self.range_search(s_region, node.right_child, rc_region)
+                if node.right_child and intersects(rc_region, s_region):
+                    stack.append((node.right_child, rc_region))
+                if node.left_child and intersects(lc_region, s_region):
+                    stack.append((node.left_child, lc_region))
 
-        return results
+    def range_search(self, s_region: list, node: Node = None, region = None):
+        return list(self.iter_range(s_region, node, region))
     
+    def range_annotations(self, s_region: list, fn = None):
+        """Counts and aggregates the datapoints that are in the hyperrectangle
+        s_region. Subtrees whose region is inside s_region add their cached 
+        annotations without visiting their leafs
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :param fn: Only the aggregates that fn needs are calculated, see 
+        aggregate_keys(). If 'count' no aggregates are returned, defaults to None
+        :type fn: str, optional
+        :return: Returns the number of datapoints and, if the tree keeps
+        aggregates, the aggregates of their payloads
+        :rtype: tuple
+        """
+
+        count = 0
+        aggregates = []
+        keep = self.aggregate and fn != 'count'
+        stack = [(self.root, self.total_region)] if self.root else []
+        while stack:
+            node, region = stack.pop()
+
+            if node.is_leaf():
+                leafs = leaf_nodes(node, s_region)
+                count += len(leafs)
+                if keep:
+                    aggregates.append(aggregate_payloads([leaf.datapoint for leaf in leafs]))
+            elif contained(region, s_region):
+                count += node.count
+                if keep:
+                    aggregates.append(node.aggregates)
+            else:
+                lc_region, rc_region = KDTree.bisect(region, node.axis, node.value)
+                if node.right_child and intersects(rc_region, s_region):
+                    stack.append((node.right_child, rc_region))
+                if node.left_child and intersects(lc_region, s_region):
+                    stack.append((node.left_child, lc_region))
+
+        return count, merge_aggregates(aggregates) if keep else None
+
+    def range_count(self, s_region: list) -> int:
+        return self.range_annotations(s_region, 'count')[0]
+
+    def range_aggregate(self, s_region: list, fn = 'sum'):
+        """Aggregates the payloads of the datapoints that are in the 
+        hyperrectangle s_region. The tree should be built with aggregate=True
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :param fn: One of 'sum', 'mean', 'min' or 'max', defaults to 'sum'
+        :type fn: str, optional
+        :raises ValueError: The tree does not keep aggregates
+        :return: The aggregated value
+        :rtype: float
+        """
+
+        if not self.aggregate:
+            raise ValueError('the tree should be built with aggregate=True')
+        return aggregate_value(self.range_annotations(s_region, fn)[1], fn)
+
+    def range_search_many(self, s_regions: list) -> list:
+        """Searches for the leaf nodes that are in each of the hyperrectangles 
+        s_regions with one walk of the tree. Every visited node keeps the 
+        queries that still intersect its region, the queries that contain
+        the region get all of its leafs and the rest move to the children
+
+        :param s_regions: The regions to search for the datapoints
+        :type s_regions: list
+        :return: Returns a list with the resulting nodes of every region
+        :rtype: list
+        """
+
+        results = [[] for _ in s_regions]
+        if self.root is None or len(s_regions) == 0:
+            return results
+
+        bounds = [region_bounds(s_region, self.dimensions) for s_region in s_regions]
+        lows = np.array([low for low, _ in bounds])
+        highs = np.array([high for _, high in bounds])
+
+        region_low, region_high = region_bounds(self.total_region, self.dimensions)
+        active = np.flatnonzero(np.all((lows <= region_high) & (highs >= region_low), axis=1))
+        stack = [(self.root, region_low, region_high, active)] if len(active) else []
+        while stack:
+            node, region_low, region_high, active = stack.pop()
+
+            if node.is_leaf():
+                leafs = leaf_nodes(node)
+                vectors = np.array([leaf.datapoint.vector[:self.dimensions] for leaf in leafs])
+                inside = np.all((lows[active, None] <= vectors) & (vectors <= highs[active, None]), axis=2)
+                for query, leaf in zip(*np.nonzero(inside)):
+                    results[active[query]].append(leafs[leaf])
+                continue
+
+            contains = np.all((lows[active] <= region_low) & (region_high <= highs[active]), axis=1)
+            if contains.any():
+                leafs = extract_leafs(node)
+                for query in active[contains]:
+                    results[query] += leafs
+                active = active[~contains]
+
+            axis = node.axis
+            if node.right_child:
+                right = active[highs[active, axis] >= node.value]
+                if len(right):
+                    right_low = region_low.copy()
+                    right_low[axis] = node.value
+                    stack.append((node.right_child, right_low, region_high, right))
+            if node.left_child:
+                left = active[lows[active, axis] <= node.value]
+                if len(left):
+                    left_high = region_high.copy()
+                    left_high[axis] = node.value
+                    stack.append((node.left_child, region_low, left_high, left))
+
+        return results
+
+    def knn(self, point, k = 1, metric = 'euclidean') -> list:
+        """Finds the k nearest datapoints to the point. The nodes are visited
+        in order of their region's distance to the point and the search stops
+        when no region can contain a point closer than the k-th best one
+
+        :param point: The query point
+        :type point: list
+        :param k: The number of neighbours to find, defaults to 1
+        :type k: int, optional
+        :param metric: One of 'euclidean', 'manhattan' or 'cosine', defaults to 'euclidean'
+        :type metric: str, optional
+        :return: Returns (distance, leaf node) pairs sorted by distance
+        :rtype: list
+        """
+
+        distance = get_distance(metric)
+        if self.root is None or k < 1:
+            return []
+
+        counter = 0
+        queue = [(region_distance(self.total_region, point, metric), counter, self.root, self.total_region)]
+        best = [] # max heap of (-distance, counter, node)
+        while queue:
+            bound, _, node, region = heapq.heappop(queue)
+            if len(best) == k and bound >= -best[0][0]:
+                break
+
+            if node.is_leaf():
+                for leaf in leaf_nodes(node):
+                    dist = distance(leaf.datapoint.vector, point)
+                    counter += 1
+                    if len(best) < k:
+                        heapq.heappush(best, (-dist, counter, leaf))
+                    elif dist < -best[0][0]:
+                        heapq.heapreplace(best, (-dist, counter, leaf))
+                continue
+
+            for child, child_region in zip([node.left_child, node.right_child],
+                    KDTree.bisect(region, node.axis, node.value)):
+                if child:
+                    counter += 1
+                    bound = region_distance(child_region, point, metric)
+                    if len(best) < k or bound < -best[0][0]:
+                        heapq.heappush(queue, (bound, counter, child, child_region))
+
+        return [(-dist, node) for dist, _, node in sorted(best, reverse = True)]
+
+    def radius_search(self, point, r, metric = 'euclidean') -> list:
+        """Finds the datapoints whose distance to the point is at most r.
+        Subtrees whose region is further than r from the point are skipped
+
+        :param point: The query point
+        :type point: list
+        :param r: The search radius
+        :type r: float
+        :param metric: One of 'euclidean', 'manhattan' or 'cosine', defaults to 'euclidean'
+        :type metric: str, optional
+        :return: Returns the leaf nodes within the radius
+        :rtype: list
+        """
+
+        distance = get_distance(metric)
+        if self.root is None:
+            return []
+
+        results = []
+        stack = [(self.root, self.total_region)]
+        while stack:
+            node, region = stack.pop()
+            if region_distance(region, point, metric) > r:
+                continue
+
+            if node.is_leaf():
+                results += [leaf for leaf in leaf_nodes(node) if distance(leaf.datapoint.vector, point) <= r]
+                continue
+
+            for child, child_region in zip([node.left_child, node.right_child],
+                    KDTree.bisect(region, node.axis, node.value)):
+                if child:
+                    stack.append((child, child_region))
+
+        return results
+
+    def insert(self, datapoint: Datapoint) -> bool:
+        """Inserts the datapoint in the tree. When the new leaf is deeper 
+        than log(n)/log(1/alpha) the deepest subtree on its path whose bigger 
+        child has more than alpha of its datapoints is rebuilt
+
+        :param datapoint: The datapoint to insert
+        :type datapoint: Datapoint
+        :return: True if the datapoint was inserted, False if
+        the tree has already a datapoint in the same position
+        :rtype: bool
+        """
+
+        if self.index is not None and not self.index.add(datapoint):
+            return False
+
+        if self.root is None:
+            self.dimensions = len(datapoint.vector)
+            self.total_region = calc_mbr([datapoint])
+            self.root = self.build([datapoint])
+            self.max_count = 1
+            return True
+
+        path = []
+        node = self.root
+        while not node.is_leaf():
+            path.append(node)
+            if datapoint.vector[node.axis] <= node.value:
+                node = node.left_child
+            else:
+                node = node.right_child
+            if node is None:
+                break
+
+        if node is None:
+            parent = path[-1]
+            leaf = self.build([datapoint], depth = parent.axis + 1)
+            if datapoint.vector[parent.axis] <= parent.value:
+                parent.left_child = leaf
+            else:
+                parent.right_child = leaf
+        else:
+            bucket = [leaf.datapoint for leaf in leaf_nodes(node)]
+            if any(dp.vector == datapoint.vector for dp in bucket):
+                return False
+            self._replace(path[-1] if path else None, node, 
+                self.build(bucket + [datapoint], depth = node.axis))
+
+        for node in reversed(path):
+            self._annotate(node)
+        for axis in range(self.dimensions):
+            self.total_region[axis] = [min(self.total_region[axis][0], datapoint.vector[axis]),
+                                       max(self.total_region[axis][1], datapoint.vector[axis])]
+
+        self.max_count = max(self.max_count, self.root.count)
+        if len(path) + 1 > math.log(self.root.count, 1/self.alpha) + 1:
+            for i in reversed(range(len(path))):
+                node = path[i]
+                if self._unbalanced(node):
+                    self._rebuild(path[i-1] if i > 0 else None, node)
+                    break
+        return True
+
+    def delete(self, point) -> bool:
+        """Deletes the datapoint with the given coordinates from the tree.
+        Internal nodes left with one child are replaced by the child and
+        the whole tree is rebuilt when it shrinks below alpha of its 
+        maximum size since the last rebuild. The total region is kept 
+        as a bounding region of the tree and it is not shrunk
+
+        :param point: The coordinates of the datapoint to delete
+        :type point: list
+        :return: True if the datapoint was deleted, False if it was not found
+        :rtype: bool
+        """
+
+        if self.root is None or (self.index is not None and point not in self.index):
+            return False
+
+        path = []
+        node = self.root
+        while node and not node.is_leaf():
+            path.append(node)
+            if point[node.axis] <= node.value:
+                node = node.left_child
+            else:
+                node = node.right_child
+
+        if node is None:
+            return False
+
+        bucket = [leaf.datapoint for leaf in leaf_nodes(node)]
+        remaining = [dp for dp in bucket if dp.vector != point]
+        if len(remaining) == len(bucket):
+            return False
+        if self.index is not None:
+            self.index.remove(point)
+
+        if remaining:
+            self._replace(path[-1] if path else None, node, self.build(remaining, depth = node.axis))
+        else:
+            # Remove the leaf and the ancestors that are left without children
+            while path:
+                parent = path.pop()
+                if parent.left_child is node:
+                    parent.left_child = None
+                else:
+                    parent.right_child = None
+                if parent.left_child or parent.right_child:
+                    break
+                node = parent
+            else:
+                self.root = None
+                self.total_region = None
+                self.max_count = 0
+                return True
+
+            child = parent.left_child or parent.right_child
+            self._replace(path[-1] if path else None, parent, child)
+
+        for ancestor in reversed(path):
+            self._annotate(ancestor)
+
+        if self.root.count < self.alpha*self.max_count:
+            self._rebuild(None, self.root)
+        return True
+
+    def _unbalanced(self, node: Node) -> bool:
+        children = [child.count for child in [node.left_child, node.right_child] if child]
+        return max(children) > self.alpha*node.count and node.count > 2
+
+    def _replace(self, parent: Node, node: Node, new_node: Node):
+        if parent is None:
+            self.root = new_node
+        elif parent.left_child is node:
+            parent.left_child = new_node
+        else:
+            parent.right_child = new_node
+
+    def _rebuild(self, parent: Node, node: Node):
+        """Replaces the subtree of the node with a balanced subtree
+        that stores the same datapoints
+
+        :param parent: The parent of the node, None if the node is the root
+        :type parent: Node
+        :param node: The root of the subtree to rebuild
+        :type node: Node
+        """
+
+        datapoints = [leaf.datapoint for leaf in extract_leafs(node)]
+        self._replace(parent, node, self.build(datapoints, depth = node.axis))
+        if parent is None:
+            self.max_count = self.root.count
+
     def bisect(region, axis, value):
         region[axis].sort()
         if value > region[axis][1] or value < region[axis][0]:
@@ -96,35 +714,632 @@ class KDTree():
         righthalf[axis][0] = value
         return lefthalf, righthalf
 
+    def save(self, path):
+        """Saves the tree to a binary file in the FlatKDTree format
+
+        :param path: The path of the file
+        :type path: str
+        """
+        FlatKDTree.from_kdtree(self).save(path)
+
+    @staticmethod
+    def load(path, mmap = True):
+        """Loads a tree that save() wrote. The tree is loaded as a FlatKDTree 
+        that has the same nodes and answers search, range_search, range_count, 
+        knn and radius_search, with Datapoints instead of leaf nodes as results.
+        It is static, so it has no insert, delete, range_search_many or
+        range_aggregate, and the payloads of the datapoints are not saved
+
+        :param path: The path of the file
+        :type path: str
+        :param mmap: If True memory map the arrays else read them in memory, defaults to True
+        :type mmap: bool, optional
+        :return: The loaded tree
+        :rtype: FlatKDTree
+        """
+        return FlatKDTree.load(path, mmap)
+
     def __str__(self, node: Node = None) -> str:
-        string = ''
         if self.root == None:
-            return string
+            return ''
 
         if node is None:
             node = self.root
 
-        string = str(node) + "\n"
-
-        for child in [node.left_child, node.right_child]:
-            if child:
-                string += self.__str__(child)
-
-        return string
+        return ''.join(str(n) + "\n" for n in iter_nodes(node))
 
     def size(self, node: Node = None) -> int:
         if self.root == None:
             return 0
 
-        size = 1
         if node is None:
             node = self.root
 
-        for child in [node.left_child, node.right_child]:
-            if child:
-                size += self.size(child)
+        return sum(1 for _ in iter_nodes(node))
+
+def _build_subtree(shm_name, shape, dtype, indexes, payloads, depth, leaf_size):
+    """Builds a KDTree subtree in a worker process of KDTree.build().
+    The coordinates are read from the shared memory block and the datapoint
+    ids of the returned encoded subtree are the rows of the coordinates.
+    If payloads are given the subtree keeps their aggregates
+    """
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        coords = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        vectors = coords[indexes].tolist()
+    finally:
+        shm.close()
+
+    if payloads is None:
+        datapoints = [Datapoint(vector, i) for vector, i in zip(vectors, indexes.tolist())]
+    else:
+        payloads = [None if math.isnan(p) else p for p in payloads.tolist()]
+        datapoints = [Datapoint(vector, i, p) for vector, i, p in zip(vectors, indexes.tolist(), payloads)]
+
+    tree = KDTree(leaf_size=leaf_size, aggregate=payloads is not None)
+    tree.dimensions = shape[1]
+    return tree.encode(tree.build(datapoints, depth))
+
+class LazyNode(Node):
+    """A node of a subtree that KDTree.encode() returned as arrays. 
+    The children of the node are created the first time they are 
+    used and then the node becomes a plain Node, so the nodes of the 
+    subtree that are never visited are never created
+
+    :param encoded: The encoded subtree
+    :type encoded: dict
+    :param datapoints: The datapoints that the encoded ids index
+    :type datapoints: list
+    :param position: The position of the node in the arrays, defaults to 0
+    :type position: int, optional
+    """
+
+    def __init__(self, encoded: dict, datapoints: list, position = 0):
+        left, right = encoded['children'][position].tolist()
+        leafs = None
+        if left < 0 and right < 0:
+            start = encoded['starts'][position]
+            leafs = [datapoints[i] for i in encoded['ids'][start:start + encoded['counts'][position]].tolist()]
+
+        super().__init__(encoded['values'][position].item(), int(encoded['axes'][position]), 
+                         datapoint = leafs[0] if leafs and len(leafs) == 1 else None,
+                         datapoints = leafs if leafs and len(leafs) > 1 else None)
+        self.count = int(encoded['counts'][position])
+        if 'n' in encoded:
+            n, total, low, high = [encoded[key][position].item() for key in ['n', 'sum', 'min', 'max']]
+            self.aggregates = {'n': int(n), 'sum': total, 'min': None if math.isnan(low) else low, 
+                               'max': None if math.isnan(high) else high}
+
+        if leafs is None:
+            # Removed so that __getattr__ creates them on first use
+            del self.left_child, self.right_child
+            self.encoded = encoded
+            self.all_datapoints = datapoints
+            self.children = (left, right)
+
+    def __getattr__(self, name):
+        if name not in ('left_child', 'right_child') or 'encoded' not in self.__dict__:
+            raise AttributeError(name)
+
+        # A child that was set before the first use is kept
+        encoded, datapoints = self.__dict__.pop('encoded'), self.__dict__.pop('all_datapoints')
+        for side, position in zip(['left_child', 'right_child'], self.__dict__.pop('children')):
+            if side not in self.__dict__:
+                self.__dict__[side] = LazyNode(encoded, datapoints, position) if position >= 0 else None
+        self.__class__ = Node
+        return self.__dict__[name]
+
+class FlatKDTree():
+    """N-Dimensional k-d tree stored in flat NumPy arrays.
+    The nodes are rows of the split value, axis, child index and bounding box
+    arrays and the points are rows of one contiguous (n, d) coordinates array,
+    ordered so that every node covers a contiguous block of rows.
+    It has the same search, range_search, range_count, knn and radius_search 
+    API as KDTree but it returns the found points as Datapoints. 
+    It is static, it has no insert or delete
+
+    :param datapoints: The datapoints to generate the tree. It can also be 
+    an (n, d) array of coordinates. If None creates an empty tree, defaults to None
+    :type datapoints: list, optional
+    :param ids: The ids of the points when datapoints is an array of coordinates.
+    If None the row numbers are used, defaults to None
+    :type ids: list, optional
+    :param leaf_size: The maximum number of points in a leaf, defaults to 16
+    :type leaf_size: int, optional
+    """
+    def __init__(self, datapoints = None, ids = None, leaf_size = 16):
+        self.leaf_size = max(1, leaf_size)
+
+        if datapoints is None or len(datapoints) == 0:
+            coords = np.empty((0, 1))
+            ids = np.empty(0)
+        elif isinstance(datapoints[0], Datapoint):
+            coords = np.array([dp.vector for dp in datapoints])
+            ids = np.array([dp.id for dp in datapoints])
+        else:
+            coords = np.array(datapoints)
+            ids = np.arange(len(coords)) if ids is None else np.array(ids)
+        if coords.ndim == 1:
+            coords = coords.reshape(-1, 1)
+
+        self.dimensions = coords.shape[1]
+        self.build(coords, ids)
+
+    def build(self, coords, ids):
+        """Builds the node arrays. The points are split at the median of the
+        node's axis and reordered in place so that the left child's points 
+        come before the right child's points
+
+        :param coords: The (n, d) coordinates array
+        :type coords: numpy.ndarray
+        :param ids: The ids of the points
+        :type ids: numpy.ndarray
+        """
+
+        n = len(coords)
+        order = np.arange(n)
+        values, axes, lefts, rights, starts, ends, lowers, uppers = [], [], [], [], [], [], [], []
+
+        # Every stack entry is (start, end, depth, parent, is_right_child)
+        stack = [(0, n, 0, -1, False)] if n else []
+        while stack:
+            start, end, depth, parent, is_right = stack.pop()
+            node = len(values)
+            if parent >= 0:
+                if is_right:
+                    rights[parent] = node
+                else:
+                    lefts[parent] = node
+
+            block = coords[order[start:end]]
+            lowers.append(block.min(axis=0))
+            uppers.append(block.max(axis=0))
+            starts.append(start)
+            ends.append(end)
+            lefts.append(-1)
+            rights.append(-1)
+
+            axis, value, mask = -1, 0, None
+            if end - start > self.leaf_size:
+                for offset in range(self.dimensions):
+                    ax = (depth + offset)%self.dimensions
+                    column = block[:, ax]
+                    median = np.partition(column, (len(column)-1)//2)[(len(column)-1)//2]
+                    if median == column.max():
+                        smaller = column[column < median]
+                        if len(smaller) == 0:
+                            continue
+                        median = smaller.max()
+                    axis, value, mask = ax, median, column <= median
+                    break
+
+            values.append(value)
+            axes.append(axis)
+            if axis < 0:
+                continue
+
+            segment = order[start:end]
+            order[start:end] = np.concatenate((segment[mask], segment[~mask]))
+            split = start + int(mask.sum())
+            stack.append((split, end, depth + 1, node, True))
+            stack.append((start, split, depth + 1, node, False))
+
+        self.split_value = np.array(values, dtype=coords.dtype if n else float)
+        self.split_axis = np.array(axes, dtype=np.int64)
+        self.left_child = np.array(lefts, dtype=np.int64)
+        self.right_child = np.array(rights, dtype=np.int64)
+        self.start = np.array(starts, dtype=np.int64)
+        self.end = np.array(ends, dtype=np.int64)
+        self.lower = np.array(lowers).reshape(-1, self.dimensions)
+        self.upper = np.array(uppers).reshape(-1, self.dimensions)
+        self.coords = np.ascontiguousarray(coords[order])
+        self.ids = ids[order]
+        self.ids_none = None # Marks the None ids of a loaded tree, see save()
+
+    def to_datapoints(self, indexes) -> list:
+        """Creates the Datapoints of the given rows of the coordinates array
+
+        :param indexes: The rows of the points
+        :type indexes: list
+        :return: A list of Datapoints
+        :rtype: list
+        """
+        ids = self.ids[indexes].tolist()
+        if self.ids_none is not None:
+            ids = [None if none else id for id, none in zip(ids, self.ids_none[indexes].tolist())]
+        return [Datapoint(vector, id) for vector, id in zip(self.coords[indexes].tolist(), ids)]
+
+    def search(self, point) -> Datapoint:
+        if len(self.split_axis) == 0:
+            return None
+
+        point = np.asarray(point)
+        node = 0
+        while node >= 0 and self.split_axis[node] >= 0:
+            if point[self.split_axis[node]] <= self.split_value[node]:
+                node = self.left_child[node]
+            else:
+                node = self.right_child[node]
+
+        if node < 0:
+            return None
+
+        block = self.coords[self.start[node]:self.end[node]]
+        found = np.flatnonzero(np.all(block == point, axis=1))
+        if len(found) == 0:
+            return None
+        return self.to_datapoints([self.start[node] + found[0]])[0]
+
+    def iter_range_blocks(self, s_region: list):
+        """Yields the blocks of points that are in the hyperrectangle s_region
+        as (start, end, inside) tuples. Nodes whose bounding box is inside 
+        s_region are reported as a whole with inside None, while for leafs 
+        inside is the result of one vectorized test of their points
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :return: A generator of the blocks
+        :rtype: generator
+        """
+
+        if len(self.split_axis) == 0:
+            return
+
+        low, high = region_bounds(s_region, self.dimensions)
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if np.any(self.lower[node] > high) or np.any(self.upper[node] < low):
+                continue
+            start, end = self.start[node], self.end[node]
+            if np.all(self.lower[node] >= low) and np.all(self.upper[node] <= high):
+                yield start, end, None
+            elif self.split_axis[node] < 0:
+                block = self.coords[start:end]
+                yield start, end, np.all((block >= low) & (block <= high), axis=1)
+            else:
+                for child in [self.right_child[node], self.left_child[node]]:
+                    if child >= 0:
+                        stack.append(child)
+
+    def iter_range_indexes(self, s_region: list):
+        """Yields arrays with the rows of the coordinates array 
+        that are in the hyperrectangle s_region, one for every block
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :return: A generator of arrays of rows
+        :rtype: generator
+        """
+
+        for start, end, inside in self.iter_range_blocks(s_region):
+            yield np.arange(start, end) if inside is None else start + np.flatnonzero(inside)
+
+    def range_count(self, s_region: list) -> int:
+        """Counts the points that are in the hyperrectangle s_region.
+        Nodes inside the region add their size without visiting their points
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :return: The number of points
+        :rtype: int
+        """
+
+        return sum(int(end - start) if inside is None else int(inside.sum()) 
+                   for start, end, inside in self.iter_range_blocks(s_region))
+
+    def range_search_indexes(self, s_region: list):
+        """Searches for the points that are in the hyperrectangle s_region
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :return: Returns the rows of the coordinates array that are in the region
+        :rtype: numpy.ndarray
+        """
+
+        found = list(self.iter_range_indexes(s_region))
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(found)
+
+    def iter_range(self, s_region: list):
+        for indexes in self.iter_range_indexes(s_region):
+            yield from self.to_datapoints(indexes)
+
+    def range_search(self, s_region: list) -> list:
+        return self.to_datapoints(self.range_search_indexes(s_region))
+
+    def node_region(self, node) -> list:
+        return [[low, high] for low, high in zip(self.lower[node].tolist(), self.upper[node].tolist())]
+
+    def distances(self, start, end, point, metric = 'euclidean'):
+        """Calculates the distances of the points in the rows start to end 
+        to the point with one vectorized operation
+
+        :param start: The first row
+        :type start: int
+        :param end: The row after the last row
+        :type end: int
+        :param point: The query point
+        :type point: numpy.ndarray
+        :param metric: One of 'euclidean', 'manhattan' or 'cosine', defaults to 'euclidean'
+        :type metric: str, optional
+        :return: The distances
+        :rtype: numpy.ndarray
+        """
+
+        block = self.coords[start:end]
+        if metric == 'euclidean':
+            return np.sqrt(((block - point)**2).sum(axis=1))
+        if metric == 'manhattan':
+            return np.abs(block - point).sum(axis=1)
+        norms = np.sqrt((block**2).sum(axis=1))*np.sqrt((point**2).sum())
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(norms == 0, 1.0, 1 - (block @ point)/norms)
+
+    def knn(self, point, k = 1, metric = 'euclidean') -> list:
+        """Finds the k nearest points to the point. The nodes are visited
+        in order of their bounding box's distance to the point and the search 
+        stops when no box can contain a point closer than the k-th best one.
+        The distances of a leaf's points are calculated together
+
+        :param point: The query point
+        :type point: list
+        :param k: The number of neighbours to find, defaults to 1
+        :type k: int, optional
+        :param metric: One of 'euclidean', 'manhattan' or 'cosine', defaults to 'euclidean'
+        :type metric: str, optional
+        :return: Returns (distance, datapoint) pairs sorted by distance
+        :rtype: list
+        """
+
+        get_distance(metric)
+        if len(self.split_axis) == 0 or k < 1:
+            return []
+
+        query = np.asarray(point, dtype=float)
+        queue = [(region_distance(self.node_region(0), point, metric), 0)]
+        best = [] # max heap of (-distance, row)
+        while queue:
+            bound, node = heapq.heappop(queue)
+            if len(best) == k and bound >= -best[0][0]:
+                break
+
+            if self.split_axis[node] < 0:
+                start = int(self.start[node])
+                for row, dist in enumerate(self.distances(start, self.end[node], query, metric).tolist(), start):
+                    if len(best) < k:
+                        heapq.heappush(best, (-dist, row))
+                    elif dist < -best[0][0]:
+                        heapq.heapreplace(best, (-dist, row))
+                continue
+
+            for child in [self.left_child[node], self.right_child[node]]:
+                if child >= 0:
+                    bound = region_distance(self.node_region(child), point, metric)
+                    if len(best) < k or bound < -best[0][0]:
+                        heapq.heappush(queue, (bound, int(child)))
+
+        best = sorted(best, reverse = True)
+        datapoints = self.to_datapoints([row for _, row in best])
+        return [(-dist, dp) for (dist, _), dp in zip(best, datapoints)]
+
+    def radius_search(self, point, r, metric = 'euclidean') -> list:
+        """Finds the points whose distance to the point is at most r.
+        Nodes whose bounding box is further than r from the point are skipped
+
+        :param point: The query point
+        :type point: list
+        :param r: The search radius
+        :type r: float
+        :param metric: One of 'euclidean', 'manhattan' or 'cosine', defaults to 'euclidean'
+        :type metric: str, optional
+        :return: Returns the datapoints within the radius
+        :rtype: list
+        """
+
+        get_distance(metric)
+        if len(self.split_axis) == 0:
+            return []
+
+        query = np.asarray(point, dtype=float)
+        rows = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if region_distance(self.node_region(node), point, metric) > r:
+                continue
+
+            if self.split_axis[node] < 0:
+                start = self.start[node]
+                rows.append(start + np.flatnonzero(self.distances(start, self.end[node], query, metric) <= r))
+                continue
+
+            for child in [self.right_child[node], self.left_child[node]]:
+                if child >= 0:
+                    stack.append(child)
+
+        return self.to_datapoints(np.concatenate(rows)) if rows else []
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def __str__(self) -> str:
+        lines = []
+        for node in range(len(self.split_axis)):
+            if self.split_axis[node] < 0:
+                points = self.to_datapoints(np.arange(self.start[node], self.end[node]))
+                lines.append(', '.join(str(p) for p in points))
+            else:
+                lines.append("axis {axis}: ({value}) -> left: ({left}), right: ({right})".format(
+                    axis = self.split_axis[node], value = self.split_value[node],
+                    left = self.left_child[node], right = self.right_child[node]))
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def size(self) -> int:
+        return len(self.split_axis)
+
+    # The arrays that save() writes and load() reads
+    array_names = ['split_value', 'split_axis', 'left_child', 'right_child', 
+                   'start', 'end', 'lower', 'upper', 'coords', 'ids']
+    file_signature = b'FLATKDT1'
+
+    @classmethod
+    def from_arrays(cls, arrays: dict, leaf_size = 16):
+        """Creates a tree from its node and point arrays without building it
+
+        :param arrays: The arrays of the tree by name, see array_names,
+        and optionally the 'ids_none' array that marks the None ids
+        :type arrays: dict
+        :param leaf_size: The maximum number of points in a leaf, defaults to 16
+        :type leaf_size: int, optional
+        :return: The tree
+        :rtype: FlatKDTree
+        """
+
+        tree = cls.__new__(cls)
+        tree.leaf_size = leaf_size
+        for name in cls.array_names:
+            setattr(tree, name, arrays[name])
+        tree.ids_none = arrays.get('ids_none')
+        tree.dimensions = tree.coords.shape[1]
+        return tree
+
+    @classmethod
+    def from_kdtree(cls, kdtree: KDTree):
+        """Converts a KDTree to a FlatKDTree with the same nodes. 
+        The nodes are numbered in preorder and the datapoints are 
+        stored in the order of the KDTree's leafs
+
+        :param kdtree: The tree to convert
+        :type kdtree: KDTree
+        :return: The converted tree
+        :rtype: FlatKDTree
+        """
+
+        nodes = list(iter_nodes(kdtree.root)) if kdtree.root else []
+        numbers = {id(node): i for i, node in enumerate(nodes)}
+        datapoints = []
+        starts = []
+        for node in nodes:
+            starts.append(len(datapoints))
+            if node.is_leaf():
+                datapoints += [leaf.datapoint for leaf in leaf_nodes(node)]
+
+        coords = np.array([dp.vector for dp in datapoints]).reshape(len(datapoints), kdtree.dimensions)
+        start = np.array(starts, dtype=np.int64)
+        end = start + np.array([node.count for node in nodes], dtype=np.int64)
+
+        lower = np.empty((len(nodes), coords.shape[1]), dtype=coords.dtype)
+        upper = np.empty((len(nodes), coords.shape[1]), dtype=coords.dtype)
+        for i in reversed(range(len(nodes))):
+            node = nodes[i]
+            if node.is_leaf():
+                lower[i] = coords[start[i]:end[i]].min(axis=0)
+                upper[i] = coords[start[i]:end[i]].max(axis=0)
+            else:
+                children = [numbers[id(child)] for child in [node.left_child, node.right_child] if child]
+                lower[i] = lower[children].min(axis=0)
+                upper[i] = upper[children].max(axis=0)
+
+        child_number = lambda child: numbers[id(child)] if child else -1
+        arrays = {
+            'split_value': np.array([node.value for node in nodes], dtype=coords.dtype),
+            'split_axis': np.array([-1 if node.is_leaf() else node.axis for node in nodes], dtype=np.int64),
+            'left_child': np.array([child_number(node.left_child) for node in nodes], dtype=np.int64),
+            'right_child': np.array([child_number(node.right_child) for node in nodes], dtype=np.int64),
+            'start': start,
+            'end': end,
+            'lower': lower,
+            'upper': upper,
+            'coords': coords,
+            'ids': np.array([dp.id for dp in datapoints])}
+        return cls.from_arrays(arrays, kdtree.leaf_size)
+
+    def save(self, path):
+        """Saves the tree to a binary file. The file starts with a signature 
+        and a JSON header with the dtype, shape and offset of every array, 
+        followed by the raw arrays aligned to 64 bytes so that load() 
+        can memory map them
+
+        :param path: The path of the file
+        :type path: str
+        """
+
+        arrays = {}
+        for name in self.array_names:
+            arrays[name] = np.ascontiguousarray(getattr(self, name))
+
+        # Ids that are Python objects are saved as integers if they all are,
+        # else as strings. None ids are marked in a separate array
+        if arrays['ids'].dtype == object:
+            ids = arrays['ids'].tolist()
+            none = [id is None for id in ids]
+            if all(none[i] or (isinstance(id, int) and not isinstance(id, bool)) for i, id in enumerate(ids)):
+                arrays['ids'] = np.array([0 if id is None else id for id in ids], dtype=np.int64)
+            else:
+                arrays['ids'] = np.array(['' if id is None else str(id) for id in ids])
+            if any(none):
+                arrays['ids_none'] = np.array(none)
+        elif self.ids_none is not None:
+            arrays['ids_none'] = np.ascontiguousarray(self.ids_none)
+
+        # The header size depends on the offsets so they are computed
+        # for a header that is big enough for every offset
+        layout = {name: {'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': 0} 
+                  for name, a in arrays.items()}
+        header_size = len(json.dumps({'leaf_size': self.leaf_size, 'arrays': layout})) + 512
+        offset = len(self.file_signature) + 8 + header_size
+        for name, array in arrays.items():
+            offset += -offset%64
+            layout[name]['offset'] = offset
+            offset += array.nbytes
+        header = json.dumps({'leaf_size': self.leaf_size, 'arrays': layout}).encode()
+        header += b' '*(header_size - len(header))
+
+        with open(path, 'wb') as f:
+            f.write(self.file_signature)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            for name, array in arrays.items():
+                f.write(b'\0'*(layout[name]['offset'] - f.tell()))
+                f.write(array.tobytes())
+
+    @classmethod
+    def load(cls, path, mmap = True):
+        """Loads a tree that save() wrote. With mmap the arrays are read-only
+        numpy.memmap views of the file, so the tree opens without copying
+        and the processes that load the same file share its page cache
+
+        :param path: The path of the file
+        :type path: str
+        :param mmap: If True memory map the arrays else read them in memory, defaults to True
+        :type mmap: bool, optional
+        :raises ValueError: The file is not a saved FlatKDTree
+        :return: The loaded tree
+        :rtype: FlatKDTree
+        """
+
+        with open(path, 'rb') as f:
+            if f.read(len(cls.file_signature)) != cls.file_signature:
+                raise ValueError('the file is not a saved FlatKDTree')
+            header_size = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_size))
+
+            arrays = {}
+            for name, info in header['arrays'].items():
+                dtype, shape = np.dtype(info['dtype']), tuple(info['shape'])
+                size = int(np.prod(shape))
+                if size == 0:
+                    arrays[name] = np.empty(shape, dtype=dtype)
+                elif mmap:
+                    arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=info['offset'], shape=shape)
+                else:
+                    f.seek(info['offset'])
+                    arrays[name] = np.fromfile(f, dtype=dtype, count=size).reshape(shape)
 
-        return size
+        return cls.from_arrays(arrays, header['leaf_size'])
 
 if __name__ == "__main__":
     dictionary = {'a':[1,4],'b':[3,6],'c':[4,2],'d':[2,9],'e':[5,8],'f':[9,1],'g':[6,5],'h':[10,3],'i':[7,9],'j':[8,9]}
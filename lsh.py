@@ -1,6 +1,7 @@
 from tools import *
 import numpy as np
 import random
+import zlib
 from numpy.linalg import norm
 import matplotlib.pyplot as plt
 
@@ -113,6 +114,120 @@ def min_hash(one_hot, permutations):
         signature.append(sign_value(one_hot, permutations[i]))
     return signature
 
+MERSENNE_PRIME = 2**31 - 1
+
+def gen_hash_functions(k, seed=None, prime=MERSENNE_PRIME):
+    """Generates k universal hash functions h(x) = (a*x + b) mod prime 
+    that min hashing uses instead of permutations. Every function behaves 
+    like a random permutation of the shingle ids, without storing one
+
+    :param k: The number of hash functions, the length of the signatures
+    :type k: int
+    :param seed: The seed of the random coefficients, defaults to None
+    :type seed: int, optional
+    :param prime: The prime modulus. It should be greater than the 
+    shingle ids, defaults to 2^31-1
+    :type prime: int, optional
+    :return: The arrays of the a and b coefficients
+    :rtype: tuple
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, prime, size=k, dtype=np.int64)
+    b = rng.integers(0, prime, size=k, dtype=np.int64)
+    return a, b
+
+def shingle_ids(shingles: set, prime=MERSENNE_PRIME):
+    """Hashes the shingles of a document to integer ids in [0, prime).
+    No vocabulary is needed so the ids of every document can be 
+    generated independently
+
+    :param shingles: The set of shingles of a document
+    :type shingles: set
+    :param prime: The prime modulus of the hash functions, defaults to 2^31-1
+    :type prime: int, optional
+    :return: The array of the shingle ids
+    :rtype: numpy.ndarray
+    """
+    return np.fromiter((zlib.crc32(sh.encode('utf-8')) % prime for sh in shingles), 
+                       dtype=np.int64, count=len(shingles))
+
+def sparse_shingles(documents: list, k: int, prime=MERSENNE_PRIME):
+    """Converts the documents to a sparse CSR representation of their 
+    shingle ids. The ids of document i are indices[indptr[i]:indptr[i+1]], 
+    so the memory depends on the total number of shingles and not on the 
+    number of documents times the size of the vocabulary
+
+    :param documents: The input documents
+    :type documents: list
+    :param k: The length of the shingles
+    :type k: int
+    :param prime: The prime modulus of the hash functions, defaults to 2^31-1
+    :type prime: int, optional
+    :return: The indptr and the indices arrays
+    :rtype: tuple
+    """
+    ids = [shingle_ids(shingle(doc, k), prime) for doc in documents]
+    indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in ids], out=indptr[1:])
+    indices = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+    return indptr, indices
+
+def min_hash_sparse(indptr, indices, hash_functions, prime=MERSENNE_PRIME, max_chunk=2**24):
+    """Generates the signatures of the documents of a CSR representation.
+    The hash functions are evaluated over all the shingle ids at once and 
+    np.minimum.reduceat takes the minimum of every document. The hash
+    functions are processed in chunks of at most max_chunk hashed values.
+    Documents without shingles, shorter than k, get signatures with every 
+    value equal to prime. No hash value can be equal to prime, so they are 
+    told apart from the other documents and iter_candidate_pairs() skips them
+
+    :param indptr: The offsets of the documents in indices
+    :type indptr: numpy.ndarray
+    :param indices: The shingle ids of all documents
+    :type indices: numpy.ndarray
+    :param hash_functions: The coefficients returned by gen_hash_functions()
+    :type hash_functions: tuple
+    :param prime: The prime modulus of the hash functions, defaults to 2^31-1
+    :type prime: int, optional
+    :param max_chunk: The maximum number of values hashed at once, defaults to 2^24
+    :type max_chunk: int, optional
+    :return: A matrix with the signature of every document in its rows
+    :rtype: numpy.ndarray
+    """
+    a, b = hash_functions
+    indptr = np.asarray(indptr, dtype=np.int64)
+    indices = np.asarray(indices, dtype=np.int64)[:indptr[-1]]
+    signatures = np.full((len(indptr) - 1, len(a)), prime, dtype=np.int64)
+
+    nonempty = indptr[:-1] < indptr[1:]
+    if not nonempty.any():
+        return signatures
+    starts = indptr[:-1][nonempty]
+    step = max(1, max_chunk // len(indices))
+    for i in range(0, len(a), step):
+        hashed = (np.outer(a[i:i+step], indices) + b[i:i+step, None]) % prime
+        signatures[nonempty, i:i+step] = np.minimum.reduceat(hashed, starts, axis=1).T
+    return signatures
+
+def min_hash_batch(shingle_ids, hash_functions, prime=MERSENNE_PRIME):
+    """Generates the signatures of many documents at once from a list 
+    with the shingle ids of every document. See min_hash_sparse()
+
+    :param shingle_ids: The integer ids of the shingles of every document
+    :type shingle_ids: list
+    :param hash_functions: The coefficients returned by gen_hash_functions()
+    :type hash_functions: tuple
+    :param prime: The prime modulus of the hash functions, defaults to 2^31-1
+    :type prime: int, optional
+    :return: A matrix with the signature of every document in its rows
+    :rtype: numpy.ndarray
+    """
+    ids = [np.asarray(x, dtype=np.int64) for x in shingle_ids]
+    indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in ids], out=indptr[1:])
+    indices = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+    return min_hash_sparse(indptr, indices, hash_functions, prime)
+
 def split_signature(sign, b):
     """Splits the signature into b bands. For example if signature is 100 values long
     and b is 50 then it will split the singature to 50 bands of 2 values each.
@@ -136,6 +251,7 @@ def calc_candidate_pairs(names, sign_matrix):
     """Calculates for every possible pair of signatures if they are considered candidate pairs
     meaning if they have at least one identical band.
     If that is the case then those enties belong to the same bucket. 
+    Documents without shingles are never candidate pairs, see iter_candidate_pairs()
 
     :param names: The names of the original documents. 
     The names are used to trace back which signatures belong to the input documents.
@@ -146,31 +262,73 @@ def calc_candidate_pairs(names, sign_matrix):
     indicates if a pair is cadidate pair or not.
     :rtype: list
     """    
+    candidates = set(iter_candidate_pairs(range(len(names)), sign_matrix))
     cand_pairs = []
     for i in range(len(names)):
         for j in range(i):
-            candidate = False
             id = str(names[i]) + '-' + str(names[j])
-            for a,b in zip(sign_matrix[i], sign_matrix[j]):
-                comp = (a == b)
-                if comp.all():
-                    candidate = True
-                    break
-            cand_pairs.append([id, candidate])
+            cand_pairs.append([id, (i, j) in candidates])
     return cand_pairs
 
-def LSH(documents, ids=None, k=8, sign_length=100 , b=20):
+def iter_candidate_pairs(names, sign_matrix, prime=MERSENNE_PRIME):
+    """Generates the candidate pairs with the LSH buckets. The documents 
+    are grouped into buckets by the values of every band and the documents 
+    that fall in the same bucket are candidate pairs. Every pair is generated once, so the time 
+    depends on the number of documents and of candidate pairs and not on 
+    all possible pairs.
+    Documents without shingles, whose signature values are all equal to prime, 
+    are not put in any bucket. Their Jaccard similarity is undefined and their 
+    signatures are identical, so they would be candidates of each other in every band
+
+    :param names: The names of the original documents
+    :type names: list
+    :param sign_matrix: The splitted signatures
+    :type sign_matrix: list
+    :param prime: The prime modulus of the hash functions, defaults to 2^31-1
+    :type prime: int, optional
+    :return: A generator of (name i, name j) tuples with i > j
+    :rtype: generator
+    """
+    names = list(names)
+    sign_matrix = np.asarray(sign_matrix)
+    if len(names) == 0:
+        return
+    empty = (sign_matrix.reshape(len(names), -1) == prime).all(axis=1)
+    seen = set()
+    for band in range(sign_matrix.shape[1]):
+        #Every band row is viewed as one bytes key and grouped with np.unique 
+        #Only the buckets with more than one document are kept 
+        rows = np.ascontiguousarray(sign_matrix[:, band])
+        keys = rows.view(np.dtype((np.void, rows.itemsize*rows.shape[1]))).ravel()
+        _, bucket_ids, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        bucket_ids = bucket_ids.ravel()
+        members = np.flatnonzero((counts[bucket_ids] > 1) & ~empty)
+        if len(members) == 0:
+            continue
+        members = members[np.argsort(bucket_ids[members], kind='stable')]
+        splits = np.flatnonzero(np.diff(bucket_ids[members])) + 1
+        for bucket in np.split(members, splits):
+            bucket = bucket.tolist()
+            for x in range(1, len(bucket)):
+                for y in range(x):
+                    pair = (bucket[x], bucket[y])
+                    if pair not in seen:
+                        seen.add(pair)
+                        yield names[pair[0]], names[pair[1]]
+
+def LSH(documents, ids=None, k=8, sign_length=100 , b=20, seed=None, candidates_only=False):
     """Produces the LSH results. There are 3 steps. 
     > First the document is converted to a set of shingles and 
-    using a vocabulary of all shingles the one hot vectors of 
-    each document is generated.
-    > Second the sparse one hot vectors are converted to dense 
-    vectors called signatures.
+    every shingle is hashed to an integer id. The ids of all 
+    documents are stored in sparse CSR arrays.
+    > Second the sparse shingle ids are converted to dense 
+    vectors called signatures with universal hash functions.
     > Third is the LSH algorithm itself that after splitting the
     signatures into bands checks all possible pairs of
     documents if they are candidate pairs. Candidate pairs are
     two documents that have at least one identical band in their 
-    signature.
+    signature. With candidates_only the bands are hashed into buckets 
+    and only the candidate pairs are generated.
 
     :param documents: The input documents
     :type documents: list
@@ -183,32 +341,30 @@ def LSH(documents, ids=None, k=8, sign_length=100 , b=20):
     :type sign_length: int, optional
     :param b: The number of bands that the signature will be splitted to, defaults to 20
     :type b: int, optional
-    :return: Returns all possible pairs with the indication if the pair is candidate or not
-    :rtype: list
+    :param seed: The seed of the hash functions, defaults to None
+    :type seed: int, optional
+    :param candidates_only: Generate only the candidate pairs, defaults to False
+    :type candidates_only: bool, optional
+    :return: Returns all possible pairs with the indication if the pair is candidate or not.
+    With candidates_only a generator of the (id, id) candidate pairs
+    :rtype: list or generator
     """  
     #Step 1 ---------------------  
     if ids is None:
         ids = list(range(0,len(documents)))
 
-    shingles = []
-    for doc in documents:
-        shingles.append(shingle(doc, k))
-
-    vocab = list(gen_vocab(shingles))
-    length = len(vocab)
-
-    one_hot_arrays = []
-    for sh in shingles:
-        one_hot_arrays.append(one_hot(sh, vocab))
-    one_hot_arrays = np.array(one_hot_arrays)
+    indptr, indices = sparse_shingles(documents, k)
 
     #Step 2 ---------------------
-    signatures = []
-    permutations = gen_permutations(length, sign_length)
-    for oh in one_hot_arrays:
-        signatures.append(min_hash(oh, permutations))
+    signatures = min_hash_sparse(indptr, indices, gen_hash_functions(sign_length, seed))
 
     #Step 3 ---------------------   
+    if candidates_only:
+        if sign_length%b != 0:
+            raise ValueError('b should divide signature\'s length to an integer')
+        sign_matrix = signatures.reshape(len(signatures), b, sign_length//b)
+        return iter_candidate_pairs(ids, sign_matrix)
+
     sign_matrix = []
     for sign in signatures:
         sign_matrix.append(split_signature(sign, b))
@@ -1,110 +1,752 @@
-from tools import *
-        
-class QuadTree:
-    
-    def __init__(self, boundary: Rect, datapoints: Datapoint = None, max_points=4, depth=0):
-       
-        self.boundary = boundary
-        self.max_points = max_points
-        self.points = []
-        self.depth = depth
-        
-        self.divided = False
-
-        if datapoints:
-            for point in datapoints:
-                self.insert(point)
-
-    def divide(self):
-        
-        cx, cy = self.boundary.cx, self.boundary.cy
-        w, h = self.boundary.w / 2, self.boundary.h / 2
-        
-        self.nw = QuadTree(Rect(cx - w/2, cy - h/2, w, h),
-            max_points = self.max_points, depth = self.depth + 1)
-        self.ne = QuadTree(Rect(cx + w/2, cy - h/2, w, h),
-            max_points = self.max_points, depth = self.depth + 1)
-        self.se = QuadTree(Rect(cx + w/2, cy + h/2, w, h),
-            max_points = self.max_points, depth = self.depth + 1)
-        self.sw = QuadTree(Rect(cx - w/2, cy + h/2, w, h),
-            max_points = self.max_points, depth = self.depth + 1)
-        self.divided = True
-
-    def insert(self, point):
-        
-        if not self.boundary.contains(point):
-            return False
-
-        if len(self.points) < self.max_points:
-            self.points.append(point)
-            return True
-
-        if not self.divided:
-            self.divide()
-
-        return (self.ne.insert(point) or
-                self.nw.insert(point) or
-                self.se.insert(point) or
-                self.sw.insert(point))
-
-    def range_search(self, boundary, found_points=None):
-
-        if not found_points:
-            found_points = []
-
-        if not self.boundary.intersects(boundary): 
-            return False
-
-        for point in self.points:
-            if boundary.contains(point):
-                found_points.append(point)
-        
-        if self.divided:
-            self.nw.range_search(boundary, found_points)
-            self.ne.range_search(boundary, found_points)
-            self.se.range_search(boundary, found_points)
-            self.sw.range_search(boundary, found_points)
-        return found_points
-    
-    def __str__(self):
-       
-        sp = ' ' * self.depth * 2
-        s = str(self.boundary) + '\n'
-        s += sp + ', '.join(str(point) for point in self.points)
-        if not self.divided:
-            return s
-        return s + '\n' + '\n'.join([
-                sp + 'nw: ' + str(self.nw), sp + 'ne: ' + str(self.ne),
-                sp + 'se: ' + str(self.se), sp + 'sw: ' + str(self.sw)])
-
-    def size(self):
-        size = 0
-        if not self.divided:
-            return 1
-
-        for child in [self.nw, self.ne, self.se, self.sw]:
-            size += child.size()
-
-        return size
-
-if __name__ == "__main__":
-    dictionary = {'a':[1,4],'b':[3,6],'c':[4,2],'d':[2,9],'e':[5,8],'f':[9,1],'g':[6,5],'h':[10,3],'i':[7,9],'j':[8,9]}
-    datapoints = [Datapoint(d[1],d[0]) for d in dictionary.items()]
-    mbr = calc_mbr(datapoints)
-    boundary = Rect(math.ceil(mbr[0][1]/2), math.ceil(mbr[1][1]/2), mbr[0][1]-mbr[0][0]+1, mbr[1][1]-mbr[1][0]+1)
-    tree = QuadTree(boundary, datapoints)
-
-    print("Tree: Quad tree")
-    print("Input Datapoints: ")
-    [print(p) for p in datapoints]
-
-    print("The constructed tree: ")
-    print(tree)
-    print("Tree size:" , tree.size())
-
-    search_area = [[3,7],[7,3]]
-    search_boundary = Rect(5, 5, 4, 4)
-    print("The result when searching in area: " + str(search_area))
-    found_points = tree.range_search(search_boundary)
-    for p in found_points:
+from tools import *
+import numpy as np
+import heapq
+        
+class QuadTree:
+    
+    def __init__(self, boundary: Rect, datapoints: Datapoint = None, max_points=4, depth=0, max_depth=32, grow=False, parent=None):
+       
+        self.boundary = boundary
+        self.max_points = max_points
+        self.points = []
+        self.depth = depth
+        # Quadrants at max_depth are not divided, they keep all their points as an overflow bucket
+        self.max_depth = max_depth
+        # If True the root grows to contain the points that are inserted outside it
+        self.grow = grow
+        self.parent = parent
+        # The quadrant of every point by id(point), shared by all the quadrants of the tree.
+        # Points are kept by identity so that plain [x, y] points and equal points can be stored
+        self.locations = parent.locations if parent else {}
+        
+        self.divided = False
+
+        if datapoints:
+            for point in datapoints:
+                self.insert(point)
+
+    def divide(self):
+        
+        cx, cy = self.boundary.cx, self.boundary.cy
+        w, h = self.boundary.w / 2, self.boundary.h / 2
+        
+        self.nw = QuadTree(Rect(cx - w/2, cy - h/2, w, h),
+            max_points = self.max_points, depth = self.depth + 1, max_depth = self.max_depth, parent = self)
+        self.ne = QuadTree(Rect(cx + w/2, cy - h/2, w, h),
+            max_points = self.max_points, depth = self.depth + 1, max_depth = self.max_depth, parent = self)
+        self.se = QuadTree(Rect(cx + w/2, cy + h/2, w, h),
+            max_points = self.max_points, depth = self.depth + 1, max_depth = self.max_depth, parent = self)
+        self.sw = QuadTree(Rect(cx - w/2, cy + h/2, w, h),
+            max_points = self.max_points, depth = self.depth + 1, max_depth = self.max_depth, parent = self)
+        self.divided = True
+
+    def quadrants(self):
+        return [self.nw, self.ne, self.se, self.sw]
+
+    def quadrant_names(self):
+        return ['nw', 'ne', 'se', 'sw']
+
+    def set_quadrants(self, quadrants):
+        self.nw, self.ne, self.se, self.sw = quadrants or [None]*4
+
+    def child_for(self, point):
+        """Returns the quadrant that contains the point or None"""
+
+        for child in [self.ne, self.nw, self.se, self.sw]:
+            if child.boundary.contains(point):
+                return child
+        return None
+
+    def merge(self):
+        """Moves the points of the children to the quadrant and removes the 
+        children if they are not divided and all the points fit in the quadrant
+
+        :return: True if the children were merged else False
+        :rtype: bool
+        """
+
+        children = self.quadrants()
+        if any(child.divided for child in children):
+            return False
+        if len(self.points) + sum(len(child.points) for child in children) > self.max_points:
+            return False
+
+        for child in children:
+            for point in child.points:
+                self.locations[id(point)] = self
+            self.points += child.points
+        self.set_quadrants(None)
+        self.divided = False
+        return True
+
+    def expand(self, point):
+        """Grows the root until it contains the point. Every step doubles the
+        root's boundary towards the point and the old root becomes one quadrant
+        of the new root. The root object is kept, so its content moves to a 
+        new quadrant object and the depth of all the quadrants increases
+
+        :param point: The point outside the root
+        :type point: Datapoint
+        :return: True if the root contains the point else False
+        :rtype: bool
+        """
+
+        try:
+            x, y = point.vector[0], point.vector[1]
+        except AttributeError:
+            x, y = point
+        if not (math.isfinite(x) and math.isfinite(y)) or self.boundary.w <= 0 or self.boundary.h <= 0:
+            return False
+
+        while not self.boundary.contains(point):
+            old = self.boundary
+            child = self.push_down()
+
+            # The old root is on the side opposite to the point
+            cx = old.cx - old.w/2 if x < old.west_edge else old.cx + old.w/2
+            cy = old.cy - old.h/2 if y < old.north_edge else old.cy + old.h/2
+            self.boundary = Rect(cx, cy, 2*old.w, 2*old.h)
+            self.divide()
+            west, north = old.cx < cx, old.cy < cy
+            if west and north:
+                self.nw = child
+            elif north:
+                self.ne = child
+            elif west:
+                self.sw = child
+            else:
+                self.se = child
+        return True
+
+    def push_down(self):
+        """Moves the points and the quadrants of the root to a new quadrant
+        object with the same boundary, one level deeper, and returns it.
+        The root is left empty and not divided
+
+        :return: The new quadrant
+        :rtype: QuadTree
+        """
+
+        child = type(self)(self.boundary, max_points = self.max_points, depth = self.depth + 1, 
+                           max_depth = self.max_depth, parent = self)
+        child.points = self.points
+        for p in child.points:
+            self.locations[id(p)] = child
+        if self.divided:
+            child.divided = True
+            child.set_quadrants(self.quadrants())
+            for quadrant in child.quadrants():
+                quadrant.parent = child
+            for node in child.iter_nodes():
+                if node is not child:
+                    node.depth += 1
+
+        self.points = []
+        self.set_quadrants(None)
+        self.divided = False
+        return child
+
+    def insert(self, point):
+        
+        node = self
+        if not node.boundary.contains(point):
+            if not (self.grow and self.parent is None and self.expand(point)):
+                return False
+
+        while len(node.points) >= node.max_points and node.depth < node.max_depth:
+            if not node.divided:
+                node.divide()
+
+            node = node.child_for(point)
+            if node is None:
+                return False
+
+        node.points.append(point)
+        self.locations[id(point)] = node
+        return True
+
+    def remove(self, point):
+        """Removes the point. The quadrant of the point is found from
+        the tree's locations, and the underfull quadrants above it are merged
+
+        :param point: The point to remove. It must be the same object that was inserted
+        :type point: Datapoint
+        :return: True if the point was removed, False if it is not in the tree
+        :rtype: bool
+        """
+
+        node = self.locations.pop(id(point), None)
+        if node is None:
+            return False
+
+        node.remove_point(point)
+        node.merge_up()
+        return True
+
+    def remove_point(self, point):
+        """Removes the point object from the points of the quadrant.
+        Equal points are different objects so they are compared by identity"""
+
+        for i, p in enumerate(self.points):
+            if p is point:
+                del self.points[i]
+                return
+
+    def move(self, point, new_xy):
+        """Moves the point to the position new_xy. A point that stays in
+        the boundary of its quadrant is only updated. Otherwise it is inserted 
+        from the nearest ancestor that contains the new position and the 
+        quadrants it left are merged if they are underfull.
+        Only Datapoints can be moved because their vector is updated
+
+        :param point: The datapoint to move
+        :type point: Datapoint
+        :param new_xy: The new position (x, y)
+        :type new_xy: list
+        :return: True if the point was moved, False if it is not in the tree
+        or the new position is outside the boundary of a root that does not grow
+        :rtype: bool
+        """
+
+        node = self.locations.get(id(point))
+        if node is None:
+            return False
+
+        if node.boundary.contains(new_xy):
+            point.vector = list(new_xy)
+            return True
+
+        root = ancestor = node
+        while ancestor and not ancestor.boundary.contains(new_xy):
+            root = ancestor
+            ancestor = ancestor.parent
+        if ancestor is None:
+            if not (root.grow and root.expand(new_xy)):
+                return False
+            ancestor = root
+
+        # A root that grows moves its points to a new quadrant
+        node = self.locations[id(point)]
+        node.remove_point(point)
+        point.vector = list(new_xy)
+        ancestor.insert(point)
+        node.merge_up()
+        return True
+
+    def merge_up(self):
+        """Merges the quadrant, if it is divided, and then its 
+        ancestors until one of them can't be merged"""
+
+        node = self if self.divided else self.parent
+        while node and node.merge():
+            node = node.parent
+
+    def iter_range(self, boundary):
+        """Yields the points that are inside the boundary. The quadrants 
+        are visited with an explicit stack and the points are produced lazily,
+        in the same order as range_search returns them
+
+        :param boundary: The rectangle to search for points
+        :type boundary: Rect
+        :return: A generator of the found points
+        :rtype: generator
+        """
+
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if not node.boundary.intersects(boundary):
+                continue
+
+            for point in node.points:
+                if boundary.contains(point):
+                    yield point
+
+            if node.divided:
+                stack += reversed(node.quadrants())
+
+    def range_search(self, boundary, found_points=None):
+
+        if not found_points:
+            found_points = []
+
+        if not self.boundary.intersects(boundary): 
+            return False
+
+        found_points.extend(self.iter_range(boundary))
+        return found_points
+    
+    def knn(self, point, k = 1, metric = 'euclidean') -> list:
+        """Finds the k nearest points to the point. The quadrants are visited
+        in order of their boundary's distance to the point and the search stops
+        when no quadrant can contain a point closer than the k-th best one
+
+        :param point: The query point (x, y)
+        :type point: list
+        :param k: The number of neighbours to find, defaults to 1
+        :type k: int, optional
+        :param metric: One of 'euclidean', 'manhattan' or 'cosine', defaults to 'euclidean'
+        :type metric: str, optional
+        :return: Returns (distance, point) pairs sorted by distance
+        :rtype: list
+        """
+
+        distance = get_distance(metric)
+        if k < 1:
+            return []
+
+        counter = 0
+        queue = [(region_distance(self.boundary.region(), point, metric), counter, self)]
+        best = [] # max heap of (-distance, counter, point)
+        while queue:
+            bound, _, node = heapq.heappop(queue)
+            if len(best) == k and bound >= -best[0][0]:
+                break
+
+            for p in node.points:
+                dist = distance(p.vector, point)
+                counter += 1
+                if len(best) < k:
+                    heapq.heappush(best, (-dist, counter, p))
+                elif dist < -best[0][0]:
+                    heapq.heapreplace(best, (-dist, counter, p))
+
+            if node.divided:
+                for child in node.quadrants():
+                    counter += 1
+                    bound = region_distance(child.boundary.region(), point, metric)
+                    if len(best) < k or bound < -best[0][0]:
+                        heapq.heappush(queue, (bound, counter, child))
+
+        return [(-dist, p) for dist, _, p in sorted(best, reverse = True)]
+
+    def radius_search(self, point, r, metric = 'euclidean') -> list:
+        """Finds the points whose distance to the point is at most r.
+        Quadrants whose boundary is further than r from the point are skipped
+
+        :param point: The query point (x, y)
+        :type point: list
+        :param r: The search radius
+        :type r: float
+        :param metric: One of 'euclidean', 'manhattan' or 'cosine', defaults to 'euclidean'
+        :type metric: str, optional
+        :return: Returns the points within the radius
+        :rtype: list
+        """
+
+        distance = get_distance(metric)
+        results = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if region_distance(node.boundary.region(), point, metric) > r:
+                continue
+
+            results += [p for p in node.points if distance(p.vector, point) <= r]
+            if node.divided:
+                stack += reversed(node.quadrants())
+
+        return results
+
+    def iter_nodes(self):
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.divided:
+                stack += reversed(node.quadrants())
+
+    def __str__(self):
+       
+        strings = []
+        # Every entry is (node, label) where the label is the indentation
+        # of the parent followed by the name of the node's quadrant
+        stack = [(self, '')]
+        while stack:
+            node, label = stack.pop()
+            sp = ' ' * node.depth * 2
+            strings.append(label + str(node.boundary) + '\n' + 
+                sp + ', '.join(str(point) for point in node.points))
+            if node.divided:
+                stack += reversed([(child, sp + name + ': ') 
+                    for child, name in zip(node.quadrants(), node.quadrant_names())])
+        return '\n'.join(strings)
+
+    def size(self):
+        return sum(1 for node in self.iter_nodes() if not node.divided)
+
+class OrthTree(QuadTree):
+    """N-dimensional orthant tree, the quadtree of d dimensions (an octree 
+    for d = 3). Every divided node has 2^d children in a list where the 
+    child of an orthant has index bit i set if the orthant is in the upper 
+    half of axis i. The capacity, insert, search, remove and move logic 
+    is the QuadTree's. Boundaries are Boxes and regions in the form 
+    [[x1,x2],[y1,y2],[z1,z2],...] are also accepted
+
+    :param boundary: The area of the tree. A region includes its upper bounds
+    :type boundary: Box or list
+    :param datapoints: The datapoints to insert, defaults to None
+    :type datapoints: list, optional
+    :param max_points: The maximum number of points of a node, defaults to 4
+    :type max_points: int, optional
+    """
+
+    def __init__(self, boundary, datapoints: Datapoint = None, max_points=4, depth=0, max_depth=32, grow=False, parent=None):
+
+        if not isinstance(boundary, Box):
+            # Move the upper bounds up by the smallest step so the half open box includes them
+            boundary = Box([min(bounds) for bounds in boundary], 
+                           [math.nextafter(max(bounds), math.inf) for bounds in boundary])
+        self.children = None
+        super().__init__(boundary, datapoints, max_points, depth, max_depth, grow, parent)
+
+    def divide(self):
+
+        low, center, high = self.boundary.low, self.boundary.center, self.boundary.high
+        self.children = []
+        for orthant in range(2**self.boundary.dimensions):
+            upper = [(orthant >> axis) & 1 for axis in range(self.boundary.dimensions)]
+            box = Box([c if u else l for l, c, u in zip(low, center, upper)],
+                      [h if u else c for c, h, u in zip(center, high, upper)])
+            self.children.append(OrthTree(box, max_points = self.max_points, depth = self.depth + 1, 
+                                          max_depth = self.max_depth, parent = self))
+        self.divided = True
+
+    def quadrants(self):
+        return self.children
+
+    def quadrant_names(self):
+        return [str(orthant) for orthant in range(len(self.children))]
+
+    def set_quadrants(self, quadrants):
+        self.children = quadrants
+
+    def orthant(self, vector):
+        return sum(1 << axis for axis, (x, c) in enumerate(zip(vector, self.boundary.center)) if x >= c)
+
+    def child_for(self, point):
+
+        vector = point.vector if isinstance(point, Datapoint) else point
+        child = self.children[self.orthant(vector)]
+        return child if child.boundary.contains(point) else None
+
+    def expand(self, point):
+        """Grows the root until it contains the point, like QuadTree.expand(),
+        doubling the box in every axis towards the point
+
+        :param point: The point outside the root
+        :type point: Datapoint
+        :return: True if the root contains the point else False
+        :rtype: bool
+        """
+
+        vector = point.vector if isinstance(point, Datapoint) else point
+        if not all(math.isfinite(x) for x in vector) or any(l >= h for l, h in zip(self.boundary.low, self.boundary.high)):
+            return False
+
+        while not self.boundary.contains(point):
+            old = self.boundary
+            child = self.push_down()
+
+            low, high, center = [], [], []
+            for x, l, h in zip(vector, old.low, old.high):
+                if x < l:
+                    low.append(l - (h - l)); high.append(h); center.append(l)
+                else:
+                    low.append(l); high.append(h + (h - l)); center.append(h)
+            self.boundary = Box(low, high)
+            # The children are split exactly at the old bounds
+            self.boundary.center = center
+            self.divide()
+            self.children[self.orthant(old.low)] = child
+        return True
+
+    def iter_range(self, boundary):
+        if not isinstance(boundary, Box):
+            boundary = Box.from_region(boundary)
+        return super().iter_range(boundary)
+
+    def range_search(self, boundary, found_points=None):
+        """Searches for the points that are inside the boundary
+
+        :param boundary: The box or the region, with its upper bounds, to search
+        :type boundary: Box or list
+        :return: The found points or False if the boundary 
+        does not intersect the tree's boundary
+        :rtype: list
+        """
+
+        if not isinstance(boundary, Box):
+            boundary = Box.from_region(boundary)
+        return super().range_search(boundary, found_points)
+
+def spread_bits(v):
+    """Moves the 32 low bits of v to the even bits of a 64 bit value.
+    It works for python ints and for numpy uint64 arrays"""
+
+    v = v & 0xFFFFFFFF
+    for shift, mask in [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)]:
+        v = (v | (v << shift)) & mask
+    return v
+
+def morton_codes(xs, ys):
+    """Calculates the Z-order (Morton) codes of 2D grid cells by 
+    interleaving the bits of their coordinates, x in the even bits
+    and y in the odd bits
+
+    :param xs: The x cell coordinates, at most 32 bits
+    :type xs: numpy.ndarray or int
+    :param ys: The y cell coordinates, at most 32 bits
+    :type ys: numpy.ndarray or int
+    :return: The codes
+    :rtype: numpy.ndarray or int
+    """
+
+    if not isinstance(xs, int):
+        xs, ys = np.asarray(xs, dtype=np.uint64), np.asarray(ys, dtype=np.uint64)
+    return spread_bits(xs) | (spread_bits(ys) << 1)
+
+class LinearQuadTree:
+    """Quadtree that is bulk loaded into arrays. The boundary is divided in
+    a 2^max_depth x 2^max_depth grid and the points are sorted once by the 
+    Morton code of their grid cell, so the points of every quadrant have 
+    consecutive codes. The leaf quadrants are kept as a linear array of 
+    cells in Morton order with their ranges of codes and of points, and 
+    a range search finds the cells of a quadrant with two binary searches 
+    over the first codes of the cells
+
+    :param boundary: The area of the tree. Points outside it are not stored
+    :type boundary: Rect
+    :param datapoints: The datapoints to load, defaults to None
+    :type datapoints: list, optional
+    :param max_points: The maximum number of points of a leaf quadrant, defaults to 4
+    :type max_points: int, optional
+    :param max_depth: The maximum depth of the quadrants, at most 32, defaults to 16
+    :type max_depth: int, optional
+    """
+
+    # Quadrants with at most that many cells are not divided by range searches
+    scan_cells = 256
+
+    def __init__(self, boundary: Rect, datapoints: Datapoint = None, max_points=4, max_depth=16):
+
+        if not 1 <= max_depth <= 32:
+            raise ValueError('max_depth should be between 1 and 32')
+
+        self.boundary = boundary
+        self.max_points = max_points
+        self.max_depth = max_depth
+        self.build(datapoints or [])
+
+    def grid(self, xs, ys):
+        """Returns the grid cell coordinates of the positions xs, ys.
+        They are not clipped so positions outside the boundary get
+        cells outside the grid"""
+
+        side = 2**self.max_depth
+        gx = np.floor((np.asarray(xs, dtype=float) - self.boundary.west_edge) / self.boundary.w * side)
+        gy = np.floor((np.asarray(ys, dtype=float) - self.boundary.north_edge) / self.boundary.h * side)
+        return gx, gy
+
+    def build(self, datapoints: list):
+        """Loads the datapoints. The codes are calculated for all the points 
+        with NumPy, the points are sorted once by code and the leaf 
+        quadrants are found by splitting the sorted codes
+
+        :param datapoints: The datapoints to load
+        :type datapoints: list
+        """
+
+        coords = np.array([dp.vector[:2] for dp in datapoints], dtype=float).reshape(-1, 2)
+        inside = ((coords[:, 0] >= self.boundary.west_edge) & (coords[:, 0] < self.boundary.east_edge) &
+                  (coords[:, 1] >= self.boundary.north_edge) & (coords[:, 1] < self.boundary.south_edge))
+        indexes = np.flatnonzero(inside)
+
+        side = 2**self.max_depth
+        gx, gy = self.grid(coords[indexes, 0], coords[indexes, 1])
+        codes = morton_codes(np.clip(gx, 0, side-1), np.clip(gy, 0, side-1))
+        order = np.argsort(codes, kind='stable')
+
+        self.codes = codes[order]
+        self.coords = coords[indexes[order]]
+        self.points = [datapoints[i] for i in indexes[order]]
+
+        self.build_cells()
+
+    def build_cells(self):
+        """Finds the leaf quadrants level by level. All the quadrants of a level
+        that have more than max_points points are split at once, with binary 
+        searches for the first code of their four children
+        """
+
+        n = len(self.codes)
+        cells = {'level': [], 'code': [], 'x': [], 'y': [], 'start': [], 'end': []}
+        code = np.zeros(1 if n else 0, dtype=np.uint64)
+        x = np.zeros(len(code), dtype=np.int64)
+        y = np.zeros(len(code), dtype=np.int64)
+        start = np.zeros(len(code), dtype=np.int64)
+        end = np.full(len(code), n, dtype=np.int64)
+        for level in range(self.max_depth + 1):
+            split = end - start > self.max_points if level < self.max_depth else np.zeros(len(code), dtype=bool)
+            leaf = ~split
+            for name, values in [('level', np.full(np.count_nonzero(leaf), level, dtype=np.int64)), ('code', code[leaf]), 
+                                 ('x', x[leaf]), ('y', y[leaf]), ('start', start[leaf]), ('end', end[leaf])]:
+                cells[name].append(values)
+            if not split.any():
+                break
+
+            code, x, y, start, end = code[split], x[split], y[split], start[split], end[split]
+            shift = np.uint64(2*(self.max_depth - level - 1))
+            children = [code*np.uint64(4) + np.uint64(quadrant) for quadrant in range(4)]
+            bounds = [start] + [np.searchsorted(self.codes, child << shift, 'left') for child in children[1:]] + [end]
+            code = np.stack(children, axis=1).ravel()
+            x = np.stack([2*x + (quadrant & 1) for quadrant in range(4)], axis=1).ravel()
+            y = np.stack([2*y + (quadrant >> 1) for quadrant in range(4)], axis=1).ravel()
+            start = np.stack(bounds[:4], axis=1).ravel()
+            end = np.stack(bounds[1:], axis=1).ravel()
+            nonempty = end > start
+            code, x, y, start, end = code[nonempty], x[nonempty], y[nonempty], start[nonempty], end[nonempty]
+
+        # The leaf quadrants are sorted in Morton order by their first point
+        starts = np.concatenate(cells['start']) if n else np.zeros(0, dtype=np.int64)
+        order = np.argsort(starts, kind='stable')
+        self.cell_level = np.concatenate(cells['level'])[order] if n else np.zeros(0, dtype=np.int64)
+        self.cell_code = np.concatenate(cells['code'])[order] if n else np.zeros(0, dtype=np.uint64)
+        self.cell_x = np.concatenate(cells['x'])[order] if n else np.zeros(0, dtype=np.int64)
+        self.cell_y = np.concatenate(cells['y'])[order] if n else np.zeros(0, dtype=np.int64)
+        self.cell_start = starts[order]
+        self.cell_end = np.concatenate(cells['end'])[order] if n else np.zeros(0, dtype=np.int64)
+        # The codes of a cell are cell_key to cell_key + 4^(max_depth - level) - 1
+        self.cell_key = self.cell_code << (2*(self.max_depth - self.cell_level)).astype(np.uint64)
+
+    def iter_range(self, boundary: Rect):
+        """Yields the points that are inside the boundary. The cells of a 
+        quadrant are found with two binary searches over the first codes of 
+        the cells. A quadrant inside the boundary yields the points of all 
+        its cells. For a quadrant with at most scan_cells cells, the cells 
+        that intersect the boundary are found with NumPy and their points are 
+        checked with one vectorized test. The other quadrants are divided
+
+        :param boundary: The rectangle to search for points
+        :type boundary: Rect
+        :return: A generator of the found points
+        :rtype: generator
+        """
+
+        if len(self.codes) == 0:
+            return
+
+        side = 2**self.max_depth
+        gx0, gy0 = self.grid(boundary.west_edge, boundary.north_edge)
+        gx1, gy1 = self.grid(boundary.east_edge, boundary.south_edge)
+        gx0, gy0 = int(np.clip(gx0, -1, side)), int(np.clip(gy0, -1, side))
+        # The last cells also keep the points that are rounded up to the 
+        # grid's edge, so they are inside only if the boundary covers the edge
+        gx1 = int(np.clip(gx1, -1, side if boundary.east_edge >= self.boundary.east_edge else side-1))
+        gy1 = int(np.clip(gy1, -1, side if boundary.south_edge >= self.boundary.south_edge else side-1))
+
+        # Every stack entry is (level, x, y, first cell, end cell) where x, y 
+        # are the grid coordinates of the quadrant at its level
+        stack = [(0, 0, 0, 0, len(self.cell_key))]
+        while stack:
+            level, x, y, first, last = stack.pop()
+            size = 2**(self.max_depth - level)
+            x_lo, y_lo = x*size, y*size
+            x_hi, y_hi = x_lo + size - 1, y_lo + size - 1
+            if max(x_lo, gx0) > min(x_hi, gx1) or max(y_lo, gy0) > min(y_hi, gy1):
+                continue
+
+            # Only the cells of the boundary's edges can have points outside it
+            if gx0 < x_lo and x_hi < gx1 and gy0 < y_lo and y_hi < gy1:
+                yield from self.points[self.cell_start[first]:self.cell_end[last-1]]
+                continue
+
+            if last - first <= self.scan_cells:
+                rows = self.cell_rows(first, last, gx0, gy0, gx1, gy1)
+                xs, ys = self.coords[rows, 0], self.coords[rows, 1]
+                found = ((xs >= boundary.west_edge) & (xs < boundary.east_edge) &
+                         (ys >= boundary.north_edge) & (ys < boundary.south_edge))
+                for i in rows[found].tolist():
+                    yield self.points[i]
+                continue
+
+            # The cells of the four children split the cells of the quadrant
+            key = morton_codes(x, y) << 2*(self.max_depth - level)
+            step = 4**(self.max_depth - level - 1)
+            bounds = np.searchsorted(self.cell_key[first:last], 
+                np.array([key + step*quadrant for quadrant in range(1, 4)], dtype=np.uint64), 'left') + first
+            bounds = [first] + bounds.tolist() + [last]
+            for quadrant in reversed(range(4)):
+                if bounds[quadrant] < bounds[quadrant + 1]:
+                    stack.append((level + 1, 2*x + (quadrant & 1), 2*y + (quadrant >> 1), 
+                                  bounds[quadrant], bounds[quadrant + 1]))
+
+    def cell_rows(self, first, last, gx0, gy0, gx1, gy1):
+        """Returns the rows of the points of the cells first to last - 1 
+        that intersect the box of grid cells gx0, gy0 to gx1, gy1, in Morton order
+
+        :return: The rows of the points
+        :rtype: numpy.ndarray
+        """
+
+        size = np.int64(1) << (self.max_depth - self.cell_level[first:last])
+        x_lo, y_lo = self.cell_x[first:last]*size, self.cell_y[first:last]*size
+        cells = np.flatnonzero((x_lo <= gx1) & (x_lo + size - 1 >= gx0) & (y_lo <= gy1) & (y_lo + size - 1 >= gy0)) + first
+        starts, ends = self.cell_start[cells], self.cell_end[cells]
+        lengths = ends - starts
+        # Every row is its cell's start plus its position after the rows of the previous cells
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return np.arange(int(lengths.sum())) + offsets
+
+    def range_search(self, boundary: Rect, found_points=None):
+
+        if not found_points:
+            found_points = []
+
+        if not self.boundary.intersects(boundary): 
+            return False
+
+        found_points.extend(self.iter_range(boundary))
+        return found_points
+
+    def cell_rect(self, cell) -> Rect:
+        level, x, y = int(self.cell_level[cell]), int(self.cell_x[cell]), int(self.cell_y[cell])
+        w, h = self.boundary.w / 2**level, self.boundary.h / 2**level
+        return Rect(self.boundary.west_edge + (x + 0.5)*w, self.boundary.north_edge + (y + 0.5)*h, w, h)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __str__(self):
+        strings = []
+        for cell, (level, start, end) in enumerate(zip(self.cell_level, self.cell_start, self.cell_end)):
+            sp = ' ' * int(level) * 2
+            strings.append(sp + str(self.cell_rect(cell)) + '\n' + 
+                sp + ', '.join(str(point) for point in self.points[start:end]))
+        return '\n'.join(strings)
+
+    def size(self):
+        return len(self.cell_level)
+
+if __name__ == "__main__":
+    dictionary = {'a':[1,4],'b':[3,6],'c':[4,2],'d':[2,9],'e':[5,8],'f':[9,1],'g':[6,5],'h':[10,3],'i':[7,9],'j':[8,9]}
+    datapoints = [Datapoint(d[1],d[0]) for d in dictionary.items()]
+    mbr = calc_mbr(datapoints)
+    boundary = Rect(math.ceil(mbr[0][1]/2), math.ceil(mbr[1][1]/2), mbr[0][1]-mbr[0][0]+1, mbr[1][1]-mbr[1][0]+1)
+    tree = QuadTree(boundary, datapoints)
+
+    print("Tree: Quad tree")
+    print("Input Datapoints: ")
+    [print(p) for p in datapoints]
+
+    print("The constructed tree: ")
+    print(tree)
+    print("Tree size:" , tree.size())
+
+    search_area = [[3,7],[7,3]]
+    search_boundary = Rect(5, 5, 4, 4)
+    print("The result when searching in area: " + str(search_area))
+    found_points = tree.range_search(search_boundary)
+    for p in found_points:
         print(p)
\ No newline at end of file
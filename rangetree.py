@@ -1,4 +1,7 @@
 from tools import *
+import numpy as np
+import sys
+from collections import OrderedDict
 
 class RangeTree():
     """N-Dimensional range tree data structure
@@ -9,17 +12,60 @@ class RangeTree():
     :param axis: The dimension of the current tree. 
     It is used internally for recursion, defaults to 0
     :type axis: int, optional
+    :param leaf_size: The maximum number of datapoints in a bucket leaf. 
+    Nodes with that many datapoints or less are not split, defaults to 1
+    :type leaf_size: int, optional
+    :param cascading: If True the last dimension is stored as sorted arrays
+    with fractional cascading pointers instead of associated trees, defaults to False
+    :type cascading: bool, optional
+    :param compact: If True the last dimension is stored as flat sorted arrays
+    of indexes to the shared datapoints instead of associated trees, defaults to False
+    :type compact: bool, optional
+    :param aggregate: If True the nodes of the last dimension keep the count, sum, 
+    min and max of the payloads below them, defaults to False
+    :type aggregate: bool, optional
+    :param lazy: If True the associated structures of the tree's nodes are built
+    the first time a search needs them and kept in a cache, defaults to False
+    :type lazy: bool, optional
+    :param memory_budget: The maximum bytes of the cached associated structures 
+    of a lazy tree. The least recently used are evicted and built again 
+    when needed. If None the cache has no limit, defaults to None
+    :type memory_budget: int, optional
+    :param index: If True the tree keeps a PointIndex of its datapoints
+    for O(1) lookup() by coordinates, defaults to False
+    :type index: bool, optional
     """
 
-    def __init__(self, datapoints: Datapoint = None, axis = 0):
+    def __init__(self, datapoints: Datapoint = None, axis = 0, leaf_size = 1, cascading = False, compact = False, aggregate = False, 
+                 lazy = False, memory_budget = None, index = False):
         self.axis = axis
+        self.leaf_size = max(1, leaf_size)
+        self.cascading = cascading
+        self.compact = compact
+        self.aggregate = aggregate
+        self.lazy = lazy
+        self.memory_budget = memory_budget
+        self.cache = OrderedDict() # The built lazy associated structures and their bytes
+        self.cache_bytes = 0
+        self.hits = self.builds = self.evictions = 0
         self.dimensions = len(datapoints[0].vector) if datapoints else 1
-        self.terminalTree = True if self.axis == self.dimensions-1 else False
+        self.set_layers()
         self.root = self.build(datapoints)
+        self.index = PointIndex(datapoints) if index else None
+
+    def set_layers(self):
+        self.terminalTree = True if self.axis == self.dimensions-1 else False
+        # The tree of the second to last dimension keeps the arrays of the last one
+        self.layeredTree = (self.cascading or self.compact) and self.axis == self.dimensions-2
+        # Cascading arrays are built from the arrays of the children so they can't be lazy
+        self.lazy = self.lazy and not self.terminalTree and not (self.layeredTree and self.cascading)
 
     def build(self, datapoints: Datapoint=None) -> Node:
         """The build method of the range tree.
-        This code assumes that all datapoints are different
+        This code assumes that all datapoints are different.
+        The datapoints are sorted once for every dimension and the nodes
+        partition the sorted index lists of their parent, which are also 
+        passed to the associated trees, so the build takes O(n log^(d-1) n) time
 
         :param datapoints: The datapoints if provided become 
         the nodes of the tree, defaults to None
@@ -31,31 +77,200 @@ class RangeTree():
         if datapoints == None or len(datapoints) == 0:
             return None
 
-        values = list(set([dp.vector[self.axis] for dp in datapoints]))
-        values = sorted(values)
-        
-        mid = (len(values)-1)//2
-        nodevalue = values[mid]
+        indexes = list(range(len(datapoints)))
+        # A lazy tree builds its associated structures later so it needs only its own order
+        orders = {}
+        for axis in range(self.axis, self.axis+1 if self.lazy else self.dimensions):
+            orders[axis] = sorted(indexes, key = lambda i: datapoints[i].vector[axis])
+
+        # The arrays of the last dimension share the datapoints, their coordinates
+        # and one leaf node per datapoint that their searches return
+        coords = leafs = None
+        if self.cascading or self.compact or self.lazy:
+            datapoints = list(datapoints)
+        if self.cascading or self.compact:
+            coords = np.array([dp.vector for dp in datapoints])
+            last = self.dimensions - 1
+            leafs = [Node(dp.vector[last], last, datapoint = dp) for dp in datapoints]
+
+        # A lazy tree finds the datapoints of a node from their range in the sorted order
+        if self.lazy:
+            self.datapoints = datapoints
+            self.leafs = leafs
+            self.order = np.array(orders[self.axis], dtype=np.intp)
+            self.order_values = np.array([datapoints[i].vector[self.axis] for i in self.order])
+
+        return self._build(datapoints, coords, leafs, orders, [False]*len(datapoints))
+
+    def associated_tree(self, datapoints, coords, leafs, orders, in_left):
+        """Creates the associated tree of a node from the node's sorted 
+        index lists. The new tree has the settings of this tree
+
+        :param datapoints: All the datapoints of the top level tree
+        :type datapoints: list
+        :param coords: The coordinates array of the datapoints or None
+        :type coords: numpy.ndarray
+        :param leafs: The leaf nodes of the datapoints or None
+        :type leafs: list
+        :param orders: For every axis of the new tree the indexes
+        of its datapoints sorted by that axis
+        :type orders: dict
+        :param in_left: Scratch list that marks the datapoints
+        that go to the left child
+        :type in_left: list
+        :return: Returns the new tree
+        :rtype: RangeTree
+        """
+
+        tree = RangeTree(axis = self.axis+1, leaf_size = self.leaf_size, cascading = self.cascading, 
+                         compact = self.compact, aggregate = self.aggregate)
+        tree.dimensions = self.dimensions
+        tree.set_layers()
+        tree.root = tree._build(datapoints, coords, leafs, orders, in_left)
+        return tree
+
+    def associated(self, node: Node):
+        """Returns the associated structure of the node. The associated 
+        structure of a lazy tree's node is built if it is not in the cache
+        and the least recently used ones are evicted to keep the cache 
+        in the memory budget
+
+        :param node: The node of the tree or of one of its associated trees
+        :type node: Node
+        :return: Returns the associated tree or array of the node
+        :rtype: RangeTree or AssociatedArray
+        """
+
+        if node in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(node)
+            return node.subtree
+        if not isinstance(node.subtree, LazySubtree):
+            return node.subtree
+
+        lazy = node.subtree
+        positions = sorted(self.order[lazy.start:lazy.end])
+        points = [self.datapoints[i] for i in positions]
+        if self.layeredTree:
+            coords = np.array([dp.vector for dp in points])
+            leafs = [self.leafs[i] for i in positions]
+            indexes = np.argsort(coords[:, self.axis+1], kind='stable')
+            subtree = AssociatedArray(points, coords, indexes, self.axis+1, aggregate = self.aggregate, leafs = leafs)
+            nbytes = subtree.memory_usage() + sys.getsizeof(points) + sys.getsizeof(leafs)
+        else:
+            subtree = RangeTree(points, axis = self.axis+1, leaf_size = self.leaf_size, cascading = self.cascading, 
+                                compact = self.compact, aggregate = self.aggregate)
+            nbytes = subtree.memory_usage()
+        self.builds += 1
+
+        node.subtree = subtree
+        self.cache[node] = (lazy, nbytes)
+        self.cache_bytes += nbytes
+        while self.memory_budget is not None and self.cache_bytes > self.memory_budget and len(self.cache) > 1:
+            evicted, (evicted_lazy, evicted_bytes) = self.cache.popitem(last=False)
+            evicted.subtree = evicted_lazy
+            self.cache_bytes -= evicted_bytes
+            self.evictions += 1
+        return subtree
+
+    def _build(self, datapoints, coords, leafs, orders, in_left) -> Node:
+        """Called internally by build() for every node of the new tree
+
+        :param datapoints: All the datapoints of the top level tree
+        :type datapoints: list
+        :param coords: The coordinates array of the datapoints or None
+        :type coords: numpy.ndarray
+        :param leafs: The leaf nodes of the datapoints or None
+        :type leafs: list
+        :param orders: For the tree's axis and every next axis
+        the indexes of this node's datapoints sorted by that axis
+        :type orders: dict
+        :param in_left: Scratch list that marks the datapoints
+        that go to the left child
+        :type in_left: list
+        :return: Returns the node
+        :rtype: Node
+        """
+
+        order = orders[self.axis]
+        if len(order) == 0:
+            return None
 
-        leftpoints = [dp for dp in datapoints if dp.vector[self.axis] <= nodevalue]
-        rightpoints = [dp for dp in datapoints if dp not in leftpoints]
+        values = [datapoints[i].vector[self.axis] for i in order]
+        starts = [0] + [k for k in range(1, len(values)) if values[k] != values[k-1]]
+        mid = (len(starts)-1)//2
+        nodevalue = values[starts[mid]]
+        split = starts[mid+1] if mid+1 < len(starts) else len(values)
+
+        # Nodes with few datapoints or with one value become leafs. Leafs 
+        # with more than one datapoint are buckets without associated tree
+        # unless they are too big to scan
+        leaf = len(starts) == 1 or len(order) <= self.leaf_size
+        if leaf and len(order) > 1 and (len(order) <= self.leaf_size or self.terminalTree):
+            return self._annotate(Node(values[-1], self.axis, datapoints = [datapoints[i] for i in sorted(order)]))
 
         nodepoint = None
-        if len(values) == 1:
-            nodepoint = datapoints[0]
+        if leaf:
+            nodepoint = datapoints[min(order)]
 
-        if self.terminalTree:
+        if self.lazy:
+            start = np.searchsorted(self.order_values, values[0], 'left')
+            end = np.searchsorted(self.order_values, values[-1], 'right')
+            nodesubtree = LazySubtree(start, end)
+        elif self.terminalTree or self.layeredTree:
             nodesubtree = None
         else:
-            newaxis = self.axis+1
-            nodesubtree = RangeTree(datapoints, axis=newaxis)
+            suborders = {ax: ax_order for ax, ax_order in orders.items() if ax > self.axis}
+            nodesubtree = self.associated_tree(datapoints, coords, leafs, suborders, in_left)
             
         node = Node(nodevalue, self.axis, subtree = nodesubtree, datapoint = nodepoint)
+        node.count = len(order)
+
+        if not leaf:
+            for k in range(len(order)):
+                in_left[order[k]] = k < split
 
-        if len(values) > 1:
-            node.left_child = self.build(leftpoints)
-            node.right_child = self.build(rightpoints)
+            leftorders = {}
+            rightorders = {}
+            for ax, ax_order in orders.items():
+                if ax == self.axis:
+                    leftorders[ax] = ax_order[:split]
+                    rightorders[ax] = ax_order[split:]
+                else:
+                    leftorders[ax] = [i for i in ax_order if in_left[i]]
+                    rightorders[ax] = [i for i in ax_order if not in_left[i]]
+
+            node.left_child = self._build(datapoints, coords, leafs, leftorders, in_left)
+            node.right_child = self._build(datapoints, coords, leafs, rightorders, in_left)
+
+        if self.layeredTree and not self.lazy:
+            children = []
+            if self.cascading:
+                children = [child.subtree if child else None for child in [node.left_child, node.right_child]]
+            indexes = np.array(orders[self.axis+1], dtype=np.intp)
+            node.subtree = AssociatedArray(datapoints, coords, indexes, self.axis+1, *children, 
+                                           aggregate = self.aggregate, leafs = leafs)
             
+        return self._annotate(node)
+
+    def _annotate(self, node: Node) -> Node:
+        """Updates the payload aggregates of a node of the last dimension
+        from its children or, for a leaf, from its datapoints
+
+        :param node: The node to update
+        :type node: Node
+        :return: Returns the node
+        :rtype: Node
+        """
+
+        if not (self.aggregate and self.terminalTree):
+            return node
+
+        if node.is_leaf():
+            node.aggregates = aggregate_payloads([leaf.datapoint for leaf in leaf_nodes(node)])
+        else:
+            children = [child for child in [node.left_child, node.right_child] if child]
+            node.aggregates = merge_aggregates([child.aggregates for child in children])
         return node
 
     def search(self, point: list, node: Node = None) -> Datapoint:
@@ -65,23 +280,40 @@ class RangeTree():
         if node is None:
             node = self.root
 
-        value = point[self.axis]
+        tree = self
+        while node:
+            if point[tree.axis] > node.value:
+                node = node.right_child
+            elif node.left_child:
+                node = node.left_child
+            elif node.is_leaf() and node.subtree is not None:
+                subtree = self.associated(node)
+                if isinstance(subtree, AssociatedArray):
+                    return subtree.search(point)
+                tree = subtree
+                node = tree.root
+            else:
+                for leaf in leaf_nodes(node) if node.is_leaf() else []:
+                    if leaf.datapoint.vector == point:
+                        return leaf
+                return None
 
-        result = None
+        return None
 
-        if value <= node.value:
-            if node.left_child:
-                result = self.search(point, node.left_child)
-            elif node.is_leaf():
-                if node.subtree:
-                    result = node.subtree.search(point)
-                elif node.datapoint.vector == point:
-                    result = node
-        elif value > node.value:
-            if node.right_child:
-                result = self.search(point, node.right_child)
+    def lookup(self, point: list) -> Datapoint:
+        """Finds the datapoint with the given coordinates. It takes O(1) 
+        time with the tree's PointIndex or else it searches the tree
 
-        return result
+        :param point: The coordinates of the datapoint
+        :type point: list
+        :return: The datapoint or None if it is not in the tree
+        :rtype: Datapoint
+        """
+
+        if self.index is not None:
+            return self.index.get(point)
+        leaf = self.search(point)
+        return leaf.datapoint if leaf else None
 
     def split_search(self, start, end, node: Node, right_search = False):
         """Called internally by range_search() after the split node is found
@@ -101,26 +333,30 @@ class RangeTree():
         """
 
         subroots = []
+        while node:
+            if node.datapoints is not None:
+                subroots.append(node)
+                break
 
-        right = node.right_child
-        left = node.left_child
-        if right_search==True:
-            right = node.left_child
-            left = node.right_child
-
-        if right:
-            if start <= node.value <= end:
-                subroots.append(right)
-                if left:
-                    subroots += self.split_search(start, end, left, right_search)
-            else:
-                subroots += self.split_search(start, end, right, right_search)
-        else:
-            if start <= node.value <= end:
-                if left:
-                    subroots += self.split_search(start, end, left, right_search)
+            right = node.right_child
+            left = node.left_child
+            if right_search==True:
+                right = node.left_child
+                left = node.right_child
+
+            in_range = start <= node.value <= end
+            if right:
+                if in_range:
+                    subroots.append(right)
+                    node = left
                 else:
+                    node = right
+            elif in_range and left:
+                node = left
+            else:
+                if in_range:
                     subroots.append(node)
+                node = None
 
         return subroots
 
@@ -141,38 +377,29 @@ class RangeTree():
         if node is None:
             node = self.root
         
-        splitnode = None
+        while node:
+            if node.datapoints is not None or start <= node.value <= end:
+                return node
+            elif node.value < start:
+                node = node.right_child
+            else:
+                node = node.left_child
 
-        if start <= node.value <= end:
-            splitnode = node
-        elif node.value < start:
-            if node.right_child:
-                splitnode = self.find_split_node(start, end, node.right_child)
-        else:
-            if node.left_child:
-                splitnode = self.find_split_node(start, end, node.left_child)
+        return None
 
-        return splitnode
-
-    def range_search(self, s_region: list, node: Node = None):
-        """Searches for the leaf nodes that are 
-        in the hyperrectangle s_region
+    def find_subtrees(self, s_region: list) -> list:
+        """Finds the canonical subtrees of the tree that have
+        their points inside the bounds of s_region in the tree's axis
 
         :param s_region: The region to search for the datapoints
         :type s_region: list
-        :param node: The root/subroot from where to start the search.
-        If None provided it starts from the tree's root, defaults to None
-        :type node: Node, optional
-        :return: Returns the resulting nodes of the range search
+        :return: Returns the roots of the canonical subtrees
         :rtype: list
         """
 
         if self.root is None:
             return []
 
-        if node is None:
-            node = self.root
-
         start = s_region[self.axis][0]
         end = s_region[self.axis][1]
 
@@ -196,49 +423,630 @@ class RangeTree():
                 r_roots = self.split_search(start, end, splitnode.right_child, right_search=True)
                 subtrees = subtrees + r_roots
 
+        return subtrees
+
+    def iter_canonical(self, s_region: list):
+        """Yields the canonical parts of the last dimension that cover the 
+        datapoints in the hyperrectangle s_region. Every part is a tuple 
+        (item, lo, hi) where item is either an associated array with the
+        datapoints at positions lo to hi, or a node with lo and hi None.
+        Internal nodes have all their datapoints in s_region, while
+        the datapoints of leafs still have to be checked
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :return: A generator of the canonical parts
+        :rtype: generator
+        """
+
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, RangeTree) and item.layeredTree and item.cascading:
+                yield from item.cascade_subtrees(s_region)
+            elif isinstance(item, RangeTree):
+                stack += reversed(item.find_subtrees(s_region))
+            elif isinstance(item, AssociatedArray):
+                yield (item, *item.bounds(s_region))
+            elif item.subtree is not None:
+                stack.append(self.associated(item))
+            else:
+                yield item, None, None
+
+    def iter_range(self, s_region: list):
+        """Yields the leaf nodes that are in the hyperrectangle s_region.
+        The canonical subtrees of every level are kept in an explicit 
+        stack and the results are produced lazily, in the same order 
+        as range_search returns them
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :return: A generator of the resulting nodes of the range search
+        :rtype: generator
+        """
+
+        for item, lo, hi in self.iter_canonical(s_region):
+            if lo is not None:
+                yield from item.leafs(lo, hi)
+            elif item.is_leaf():
+                yield from leaf_nodes(item, s_region)
+            else:
+                yield from iter_leafs(item)
+
+    def cascade_subtrees(self, s_region: list):
+        """Yields the canonical parts of the last dimension, as iter_canonical()
+        does, for the tree of the second to last dimension of a cascading tree. 
+        The bounds of the last dimension are found with binary search only 
+        in the split node's array and the cascading pointers give their
+        positions in the arrays of the nodes below it
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :return: A generator of the canonical parts
+        :rtype: generator
+        """
+
+        if self.root is None:
+            return
+
+        start, end = sorted(s_region[self.axis][:2])
+        splitnode = self.find_split_node(start, end)
+        if splitnode is None:
+            return
+
+        if splitnode.subtree is None:
+            yield splitnode, None, None
+            return
+
+        array = splitnode.subtree
+        lo, hi = array.bounds(s_region)
+        if splitnode.is_leaf():
+            yield array, lo, hi
+            return
+
+        for right_search, child in [(False, splitnode.left_child), (True, splitnode.right_child)]:
+            if child is None:
+                continue
+            node, node_lo, node_hi = child, *array.follow(child, lo, hi)
+
+            while node:
+                if node.subtree is None:
+                    yield node, None, None
+                    break
+                if node_lo == node_hi:
+                    break
+
+                right, left = node.right_child, node.left_child
+                if right_search:
+                    right, left = left, right
+
+                in_range = start <= node.value <= end
+                if right and in_range:
+                    if right.subtree is None:
+                        yield right, None, None
+                    else:
+                        yield (right.subtree, *node.subtree.follow(right, node_lo, node_hi))
+                    next_node = left
+                elif right:
+                    next_node = right
+                elif in_range and left:
+                    next_node = left
+                else:
+                    if in_range:
+                        yield node.subtree, node_lo, node_hi
+                    break
+
+                if next_node is None:
+                    break
+                node_lo, node_hi = node.subtree.follow(next_node, node_lo, node_hi)
+                node = next_node
+
+    def range_search(self, s_region: list, node: Node = None):
+        """Searches for the leaf nodes that are 
+        in the hyperrectangle s_region
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :param node: The root/subroot from where to start the search.
+        If None provided it starts from the tree's root, defaults to None
+        :type node: Node, optional
+        :return: Returns the resulting nodes of the range search
+        :rtype: list
+        """
+
         results = []
-        if self.terminalTree:
-            for tree in subtrees:
-                results += extract_leafs(tree) 
-        else:
-            for tree in subtrees:
-                results += tree.subtree.range_search(s_region)
+        for item, lo, hi in self.iter_canonical(s_region):
+            if lo is not None:
+                results += item.leafs(lo, hi)
+            elif item.is_leaf():
+                results += leaf_nodes(item, s_region)
+            else:
+                results += iter_leafs(item)
         return results
 
-    def __str__(self, node: Node = None) -> str:
-        if self.root == None:
-            return ''
+    def range_annotations(self, s_region: list, fn = None):
+        """Counts and aggregates the datapoints that are in the hyperrectangle
+        s_region. The canonical subtrees and arrays add their cached 
+        annotations without visiting their leafs
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :param fn: Only the aggregates that fn needs are calculated, see 
+        aggregate_keys(). If 'count' no aggregates are returned, defaults to None
+        :type fn: str, optional
+        :return: Returns the number of datapoints and, if the tree keeps
+        aggregates, the aggregates of their payloads
+        :rtype: tuple
+        """
+
+        count = 0
+        aggregates = []
+        keep = self.aggregate and fn != 'count'
+        for item, lo, hi in self.iter_canonical(s_region):
+            if lo is not None:
+                count += hi - lo
+                if keep:
+                    aggregates.append(item.aggregates(lo, hi, aggregate_keys(fn)))
+            elif item.is_leaf():
+                leafs = leaf_nodes(item, s_region)
+                count += len(leafs)
+                if keep:
+                    aggregates.append(aggregate_payloads([leaf.datapoint for leaf in leafs]))
+            else:
+                count += item.count
+                if keep:
+                    aggregates.append(item.aggregates)
+
+        return count, merge_aggregates(aggregates) if keep else None
+
+    def range_count(self, s_region: list) -> int:
+        return self.range_annotations(s_region, 'count')[0]
+
+    def range_aggregate(self, s_region: list, fn = 'sum'):
+        """Aggregates the payloads of the datapoints that are in the 
+        hyperrectangle s_region. The tree should be built with aggregate=True
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :param fn: One of 'sum', 'mean', 'min' or 'max', defaults to 'sum'
+        :type fn: str, optional
+        :raises ValueError: The tree does not keep aggregates
+        :return: The aggregated value
+        :rtype: float
+        """
+
+        if not self.aggregate:
+            raise ValueError('the tree should be built with aggregate=True')
+        return aggregate_value(self.range_annotations(s_region, fn)[1], fn)
+
+    def iter_nodes(self, node: Node = None):
+        """Yields the nodes of the tree and of all the associated trees.
+        Every node is followed by its children's subtrees 
+        and then by its associated tree
+
+        :param node: The root/subroot from where to start. 
+        If None provided it starts from the tree's root, defaults to None
+        :type node: Node, optional
+        :return: A generator of the nodes
+        :rtype: generator
+        """
 
         if node is None:
             node = self.root
-        string = str(node) + "\n"
 
-        for child in [node.left_child, node.right_child]:
-            if child:
-                string += self.__str__(child)
-        
-        if node.subtree:
-            string += str(node.subtree)
+        stack = [node] if node else []
+        while stack:
+            node = stack.pop()
+            yield node
+            if isinstance(node.subtree, RangeTree) and node.subtree.root:
+                stack.append(node.subtree.root)
+            for child in [node.right_child, node.left_child]:
+                if child:
+                    stack.append(child)
 
-        return string
+    def __str__(self, node: Node = None) -> str:
+        if self.root == None:
+            return ''
+
+        return ''.join(str(n) + "\n" for n in self.iter_nodes(node))
 
     def size(self, node: Node = None) -> str:
         if self.root == None:
             return 0
 
-        if node is None:
-            node = self.root
-        
-        size = 1
+        return sum(1 for _ in self.iter_nodes(node))
 
-        for child in [node.left_child, node.right_child]:
-            if child:
-                size += self.size(child)
-        
-        if node.subtree:
-            size += node.subtree.size()
+    def memory_usage(self) -> int:
+        """Counts the bytes used by the tree, its nodes and its associated
+        structures. Every object is counted once, so the datapoints list that
+        the arrays share is included only one time. The datapoints themselves
+        are not part of the tree and they are not counted
+
+        :return: The memory usage of the tree in bytes
+        :rtype: int
+        """
+
+        seen = set()
+        def sizeof(obj):
+            if obj is None or id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+            return sys.getsizeof(obj)
+
+        total = sizeof(self) + sizeof(self.__dict__)
+        for node in self.iter_nodes():
+            total += sizeof(node) + sizeof(node.__dict__)
+            total += sizeof(node.datapoints) + sizeof(node.bucket)
+            if isinstance(node.subtree, RangeTree):
+                total += sizeof(node.subtree) + sizeof(node.subtree.__dict__)
+            elif isinstance(node.subtree, AssociatedArray):
+                total += node.subtree.memory_usage() + sizeof(node.subtree.datapoints)
+                if id(node.subtree.leaf_nodes) not in seen:
+                    total += sizeof(node.subtree.leaf_nodes) + sum(sizeof(leaf) + sizeof(leaf.__dict__) 
+                                                                   for leaf in node.subtree.leaf_nodes)
+            elif isinstance(node.subtree, LazySubtree):
+                total += sizeof(node.subtree) + sizeof(node.subtree.__dict__)
+        if self.lazy and self.root:
+            total += sizeof(self.cache) + sizeof(self.datapoints) + sizeof(self.order) + sizeof(self.order_values)
+        return total
+
+class AssociatedArray():
+    """The associated structure of a node for the last dimension.
+    It keeps the indexes of the node's datapoints sorted by the last 
+    dimension and their coordinates in that dimension as flat arrays, 
+    while the datapoints are shared by all the arrays of the tree.
+    For fractional cascading, for every position of the sorted values, 
+    it also keeps the first position in each child's array with a value 
+    greater or equal to the value at that position
+
+    :param datapoints: All the datapoints of the top level tree
+    :type datapoints: list
+    :param coords: The coordinates array of the datapoints
+    :type coords: numpy.ndarray
+    :param indexes: The indexes of the node's datapoints sorted by the last dimension
+    :type indexes: numpy.ndarray
+    :param axis: The last dimension
+    :type axis: int
+    :param left: The array of the node's left child, defaults to None
+    :type left: AssociatedArray, optional
+    :param right: The array of the node's right child, defaults to None
+    :type right: AssociatedArray, optional
+    :param aggregate: Keep the prefix sums of the payloads and their sparse 
+    tables of minimums and maximums, defaults to False
+    :type aggregate: bool, optional
+    :param leafs: The leaf nodes of the datapoints, shared by all the arrays
+    of the tree, that the searches return. If None they are created, defaults to None
+    :type leafs: list, optional
+    """
+
+    def __init__(self, datapoints: list, coords, indexes, axis, left = None, right = None, aggregate = False, leafs = None):
+        self.axis = axis
+        self.datapoints = datapoints
+        if leafs is None:
+            leafs = [Node(dp.vector[axis], axis, datapoint = dp) for dp in datapoints]
+        self.leaf_nodes = leafs
+        self.indexes = indexes
+        self.values = coords[indexes, axis]
+        self.left = left
+        self.right = right
+        self.left_pointers = self.cascade(left)
+        self.right_pointers = self.cascade(right)
+
+        # Missing payloads become nan. The prefix sums give the number 
+        # and the sum of the payloads of any range of positions and the 
+        # sparse tables, whose first level is the payloads, their minimum and maximum
+        self.payloads = self.prefix_n = self.prefix_sum = self.min_table = self.max_table = None
+        if aggregate:
+            self.payloads = np.array([datapoints[i].payload for i in indexes], dtype=float)
+            present = ~np.isnan(self.payloads)
+            self.prefix_n = np.concatenate(([0], np.cumsum(present)))
+            self.prefix_sum = np.concatenate(([0], np.cumsum(np.where(present, self.payloads, 0))))
+            self.min_table = AssociatedArray.sparse_table(self.payloads, np.fmin)
+            self.max_table = AssociatedArray.sparse_table(self.payloads, np.fmax)
+
+    @staticmethod
+    def sparse_table(values, pick) -> list:
+        """Returns the sparse table of the values. Level j has the pick of 
+        the 2^j values starting at every position, so the pick of any range
+        is the pick of the two overlapping ranges of a level that cover it.
+        np.fmin and np.fmax skip nan
+
+        :param values: The values
+        :type values: numpy.ndarray
+        :param pick: np.fmin or np.fmax
+        :type pick: numpy.ufunc
+        :return: The levels of the table
+        :rtype: list
+        """
+
+        table = [values]
+        while 2**len(table) <= len(values):
+            half = 2**(len(table) - 1)
+            table.append(pick(table[-1][:-half], table[-1][half:]))
+        return table
+
+    def cascade(self, child):
+        if child is None:
+            return None
+        # The extra last pointer is the position after the end of the child's array
+        positions = np.searchsorted(child.values, self.values, 'left')
+        return np.append(positions, len(child.values))
+
+    def follow(self, child: Node, lo, hi):
+        """Translates the positions lo and hi of this array to
+        the positions in the array of the child node in O(1)"""
+
+        if child.subtree is None:
+            return lo, hi
+        pointers = self.left_pointers if child.subtree is self.left else self.right_pointers
+        return int(pointers[lo]), int(pointers[hi])
+
+    def leafs(self, lo, hi) -> list:
+        """Returns the shared leaf nodes of the datapoints at positions lo to hi"""
+
+        return list(map(self.leaf_nodes.__getitem__, self.indexes[lo:hi].tolist()))
+
+    def bounds(self, s_region: list):
+        """Returns the positions lo, hi of the array where the 
+        datapoints in the bounds of s_region's last dimension are"""
+
+        low, high = sorted(s_region[self.axis][:2])
+        return int(self.values.searchsorted(low, 'left')), int(self.values.searchsorted(high, 'right'))
+
+    def iter_range(self, s_region: list):
+        yield from self.leafs(*self.bounds(s_region))
+
+    def aggregates(self, lo, hi, keys = ('sum', 'min', 'max')) -> dict:
+        """Returns the payload aggregates of the datapoints at positions lo to hi 
+        in O(1). Only the count 'n' and the aggregates in keys are calculated"""
+
+        result = {'n': int(self.prefix_n[hi] - self.prefix_n[lo]), 'sum': 0, 'min': None, 'max': None}
+        if result['n'] == 0:
+            return result
+        if 'sum' in keys:
+            result['sum'] = float(self.prefix_sum[hi] - self.prefix_sum[lo])
+        level = (hi - lo).bit_length() - 1
+        for key, table, pick in [('min', self.min_table, np.fmin), ('max', self.max_table, np.fmax)]:
+            if key in keys:
+                result[key] = float(pick(table[level][lo], table[level][hi - 2**level]))
+        return result
+
+    def search(self, point: list) -> Node:
+        lo = np.searchsorted(self.values, point[self.axis], 'left')
+        hi = np.searchsorted(self.values, point[self.axis], 'right')
+        for leaf in self.leafs(lo, hi):
+            if leaf.datapoint.vector == point:
+                return leaf
+        return None
+
+    def memory_usage(self) -> int:
+        """The bytes of the array object and of its own arrays.
+        The shared datapoints and coordinates are not included"""
+
+        arrays = [self.values, self.indexes, self.left_pointers, self.right_pointers, 
+                  self.prefix_n, self.prefix_sum] + (self.min_table or []) + (self.max_table or [])[1:]
+        return (sys.getsizeof(self) + sys.getsizeof(self.__dict__) + 
+                sum(sys.getsizeof(a) for a in arrays if a is not None))
+
+    def __len__(self) -> int:
+        return len(self.indexes)
+
+    def __str__(self) -> str:
+        return '[' + ', '.join(str(self.datapoints[i]) for i in self.indexes) + ']'
+
+class LazySubtree():
+    """Placeholder for the associated structure of a lazy tree's node 
+    that is not built. The node's datapoints are at positions 
+    start to end of the tree's sorted order
+
+    :param start: The first position of the node's datapoints
+    :type start: int
+    :param end: The position after the last datapoint of the node
+    :type end: int
+    """
+
+    def __init__(self, start, end):
+        self.start = int(start)
+        self.end = int(end)
+
+    def __str__(self) -> str:
+        return "not built [{}:{}]".format(self.start, self.end)
+
+class DynamicRangeTree():
+    """Range tree that supports inserts and deletes with the logarithmic method. 
+    The datapoints are kept in static range trees, the blocks, where the block 
+    of level i has at most 2^i datapoints. An insert merges the new datapoint 
+    with the full levels below the first empty level and builds one block there,
+    so every datapoint is rebuilt O(log n) times. A delete marks the datapoint 
+    as deleted in its block and the deleted datapoints are dropped when their 
+    block is rebuilt, or by a rebuild of all the blocks when they are more than 
+    the live datapoints. Queries search all the blocks and skip the deleted 
+    datapoints of every block, which are also kept in an insert only 
+    DynamicRangeTree of the block so that they are counted without a scan.
+    A PointIndex of the live datapoints finds duplicates and deleted
+    datapoints in O(1) time
+
+    :param datapoints: The initial datapoints, defaults to None
+    :type datapoints: list, optional
+    :param options: The arguments of the RangeTree blocks, such as leaf_size, 
+    cascading, compact and aggregate
+    :type options: dict, optional
+    """
+
+    def __init__(self, datapoints: list = None, **options):
+        self.options = options
+        self.blocks = []
+        self.deleted = [] # The deleted datapoints that are still in every block
+        self.tombstones = [] # The deleted datapoints of every block as a DynamicRangeTree or None
+        self.levels = {} # The level of the block of every live datapoint
+        self.count = 0 # The number of datapoints in the blocks
+        # Like insert, the index keeps the first datapoint of every position
+        self.index = PointIndex(datapoints)
+        if datapoints:
+            self.rebuild(list(self.index))
+
+    def rebuild(self, datapoints: list = None):
+        """Builds one block with the live datapoints, or with the datapoints
+        if they are provided, at the lowest level that can hold them
+
+        :param datapoints: The datapoints of the new block. If None 
+        the live datapoints of the tree are used, defaults to None
+        :type datapoints: list, optional
+        """
+
+        if datapoints is None:
+            datapoints = list(self.iter_datapoints())
+        level = max(0, math.ceil(math.log2(len(datapoints)))) if datapoints else 0
+        self.blocks = [None]*level + [RangeTree(datapoints, **self.options) if datapoints else None]
+        self.deleted = [set() for _ in self.blocks]
+        self.tombstones = [None]*len(self.blocks)
+        self.levels = {datapoint: level for datapoint in datapoints}
+        self.count = len(datapoints)
+
+    def iter_datapoints(self):
+        """Yields the live datapoints of all the blocks"""
+
+        for block, deleted in zip(self.blocks, self.deleted):
+            for datapoint in DynamicRangeTree.block_datapoints(block):
+                if datapoint not in deleted:
+                    yield datapoint
+
+    @staticmethod
+    def block_datapoints(block: RangeTree) -> list:
+        """Returns all the datapoints of a block. The leafs of the top level
+        tree are not enough since a leaf can keep more datapoints with the 
+        same value in its associated tree, so the whole space is searched"""
+
+        if block is None or block.root is None:
+            return []
+        return [leaf.datapoint for leaf in block.iter_range([[-math.inf, math.inf]]*block.dimensions)]
+
+    def lookup(self, point: list) -> Datapoint:
+        return self.index.get(point)
+
+    def search(self, point: list) -> Node:
+        for block, deleted in zip(self.blocks, self.deleted):
+            if block is None:
+                continue
+            leaf = block.search(point)
+            if leaf is not None and leaf.datapoint not in deleted:
+                return leaf
+        return None
+
+    def insert(self, datapoint: Datapoint) -> bool:
+        """Inserts the datapoint. The blocks of the levels below the first 
+        empty level are merged with it in a new block of that level
+
+        :param datapoint: The datapoint to insert
+        :type datapoint: Datapoint
+        :return: True if the datapoint was inserted, False if
+        the tree has already a datapoint in the same position
+        :rtype: bool
+        """
+
+        if not self.index.add(datapoint):
+            return False
+
+        datapoints = [datapoint]
+        level = 0
+        while level < len(self.blocks) and self.blocks[level] is not None:
+            for block_datapoint in DynamicRangeTree.block_datapoints(self.blocks[level]):
+                if block_datapoint in self.deleted[level]:
+                    self.count -= 1
+                else:
+                    datapoints.append(block_datapoint)
+            self.blocks[level] = None
+            self.deleted[level] = set()
+            self.tombstones[level] = None
+            level += 1
+
+        if level == len(self.blocks):
+            self.blocks.append(None)
+            self.deleted.append(set())
+            self.tombstones.append(None)
+        self.blocks[level] = RangeTree(datapoints, **self.options)
+        for block_datapoint in datapoints:
+            self.levels[block_datapoint] = level
+        self.count += 1
+        return True
+
+    def delete(self, point: list) -> bool:
+        """Marks the datapoint with the given coordinates as deleted
+        in its block. All the blocks are rebuilt when the deleted 
+        datapoints are more than the live datapoints
+
+        :param point: The coordinates of the datapoint to delete
+        :type point: list
+        :return: True if the datapoint was deleted, False if it was not found
+        :rtype: bool
+        """
+
+        datapoint = self.index.remove(point)
+        if datapoint is None:
+            return False
+
+        level = self.levels.pop(datapoint)
+        self.deleted[level].add(datapoint)
+        if self.tombstones[level] is None:
+            self.tombstones[level] = DynamicRangeTree()
+        self.tombstones[level].insert(datapoint)
+        if self.count - len(self) > len(self):
+            self.rebuild()
+        return True
+
+    def iter_range(self, s_region: list):
+        """Yields the leaf nodes of the live datapoints 
+        that are in the hyperrectangle s_region
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :return: A generator of the resulting nodes of the range search
+        :rtype: generator
+        """
+
+        for block, deleted in zip(self.blocks, self.deleted):
+            if block is None:
+                continue
+            for leaf in block.iter_range(s_region):
+                if leaf.datapoint not in deleted:
+                    yield leaf
+
+    def range_search(self, s_region: list) -> list:
+        return list(self.iter_range(s_region))
+
+    def range_count(self, s_region: list) -> int:
+        """Counts the live datapoints that are in the hyperrectangle s_region
+        from the counts of the blocks minus the counts of their deleted datapoints
+
+        :param s_region: The region to search for the datapoints
+        :type s_region: list
+        :return: The number of datapoints
+        :rtype: int
+        """
+
+        count = 0
+        for block, tombstones in zip(self.blocks, self.tombstones):
+            if block is not None:
+                count += block.range_count(s_region)
+            if tombstones is not None:
+                count -= tombstones.range_count(s_region)
+        return count
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+    def __str__(self) -> str:
+        output = ''
+        for level, block in enumerate(self.blocks):
+            if block is not None:
+                output += "block {}:\n".format(level) + str(block)
+        return output
+
+    def size(self) -> int:
+        return sum(block.size() for block in self.blocks if block is not None)
 
-        return size
+    def memory_usage(self) -> int:
+        return sum(block.memory_usage() for block in self.blocks + self.tombstones if block is not None)
 
 if __name__ == "__main__":
     dictionary = {'a':[1,4,2],'b':[3,6,2],'c':[4,2,2],'d':[2,9,8],'e':[5,8,4]}
@@ -1,6 +1,7 @@
 import os
 import nltk
 import math
+import numpy as np
 from sklearn.feature_extraction.text import CountVectorizer
 from nltk.stem import PorterStemmer
 from nltk.tokenize import word_tokenize
@@ -14,9 +15,11 @@ from nltk.corpus import stopwords
 #     nltk.download('stopwords')
 
 class Datapoint():
-    def __init__(self, vector, id = None):
+    def __init__(self, vector, id = None, payload = None, count = 1):
         self.vector = vector if isinstance(vector, list) else [vector]
         self.id = id
+        self.payload = payload
+        self.count = count # The number of grouped points with these coordinates
         
     def __str__(self) -> str:
         string = str(self.id) + ' = [' + str(self.vector[0])
@@ -44,13 +47,18 @@ class Datapoint():
         return True
 
 class Node():
-    def __init__(self, value, axis, l_child = None, r_child = None, datapoint: Datapoint = None, subtree = None):
+    def __init__(self, value, axis, l_child = None, r_child = None, datapoint: Datapoint = None, subtree = None, datapoints: list = None):
         self.value = value
         self.axis = axis
         self.left_child: Node = l_child
         self.right_child: Node = r_child
         self.datapoint: Datapoint = datapoint
         self.subtree = subtree
+        # A bucket leaf keeps its datapoints and their coordinates array
+        self.datapoints: list = datapoints
+        self.bucket = np.array([dp.vector for dp in datapoints]) if datapoints else None
+        self.count = len(datapoints) if datapoints else 1 # The number of datapoints below the node
+        self.aggregates: dict = None # The payload aggregates of the datapoints below the node
         
     def is_leaf(self):
         """Checks if the node is a leaf. A leaf node has no child nodes
@@ -63,6 +71,11 @@ class Node():
         else:
             return True  
 
+    def leaf_str(self) -> str:
+        if self.datapoints:
+            return ', '.join(str(dp) for dp in self.datapoints)
+        return str(self.datapoint)
+
     def __str__(self) -> str:
         head_str = "axis {axis}: ({value}) -> "
         childs_str = "left: ({lvalue}), right: ({rvalue})"
@@ -70,29 +83,29 @@ class Node():
         axis = self.axis
 
         if self.is_leaf():
-            if self.datapoint:
-                output = str(self.datapoint)
+            if self.datapoint or self.datapoints:
+                output = self.leaf_str()
             else:
                 output = str(self.value)
         else:
             value = self.value
             if self.left_child:
                 if self.left_child.is_leaf():
-                    lvalue = str(self.left_child.datapoint)
+                    lvalue = self.left_child.leaf_str()
                 else:
                     lvalue = str(self.left_child.value)
 
             if self.right_child:
                 if self.right_child.is_leaf():
-                    rvalue = str(self.right_child.datapoint)
+                    rvalue = self.right_child.leaf_str()
                 else:
                     rvalue = str(self.right_child.value)
             
             output = head_str.format(axis = axis, value = value)
             output += childs_str.format(lvalue = lvalue, rvalue = rvalue)
 
-        if self.subtree:
-            output += ", subtree: " + str(self.subtree.root)
+        if self.subtree is not None:
+            output += ", subtree: " + str(getattr(self.subtree, 'root', self.subtree))
             
         return output
 
@@ -120,6 +133,11 @@ class Rect:
                 point_y >= self.north_edge and
                 point_y < self.south_edge)
 
+    def region(self):
+        """Returns the rectangle in the region form [[x1,x2],[y1,y2]]"""
+
+        return [[self.west_edge, self.east_edge], [self.north_edge, self.south_edge]]
+
     def intersects(self, other):
         
         return not (other.west_edge > self.east_edge or
@@ -127,6 +145,90 @@ class Rect:
                     other.north_edge > self.south_edge or
                     other.south_edge < self.north_edge)
 
+class Box:
+    """N-dimensional axis-aligned box. It contains the points with 
+    low <= x < high in every axis like Rect, or low <= x <= high
+    if it is closed like the regions of range searches
+
+    :param low: The lower bound of every axis
+    :type low: list
+    :param high: The upper bound of every axis
+    :type high: list
+    :param closed: If True the upper bounds are included, defaults to False
+    :type closed: bool, optional
+    """
+
+    def __init__(self, low, high, closed = False):
+        self.low, self.high = list(low), list(high)
+        self.closed = closed
+        self.center = [(l + h)/2 for l, h in zip(self.low, self.high)]
+        self.dimensions = len(self.low)
+
+    @classmethod
+    def from_region(cls, region, closed = True):
+        """Creates the box of a region in the form [[x1,x2],[y1,y2],[z1,z2],...]
+        where the bounds of an axis can be in any order. The region is 
+        closed by default, like the regions of the trees' range searches
+        """
+
+        return cls([min(bounds) for bounds in region], [max(bounds) for bounds in region], closed)
+
+    def __str__(self):
+        return '(' + ', '.join('{:.2f}'.format(v) for v in self.low + self.high) + ')'
+
+    def contains(self, point):
+
+        vector = point.vector if isinstance(point, Datapoint) else point
+        for x, low, high in zip(vector, self.low, self.high):
+            if x < low or x > high or (x == high and not self.closed):
+                return False
+        return True
+
+    def region(self):
+        """Returns the box in the region form [[x1,x2],[y1,y2],[z1,z2],...]"""
+
+        return [[low, high] for low, high in zip(self.low, self.high)]
+
+    def intersects(self, other):
+
+        for low, high, other_low, other_high in zip(self.low, self.high, other.low, other.high):
+            if other_low > high or other_high < low:
+                return False
+        return True
+
+def iter_nodes(node: Node):
+    """Takes a node of a tree/subtree and yields all the nodes
+    below that node in preorder, using an explicit stack
+
+    :param node: The root/subroot node of the tree/subtree
+    :type node: Node
+    :return: A generator of the node and all the nodes below it
+    :rtype: generator
+    """
+
+    stack = [node] if node else []
+    while stack:
+        node = stack.pop()
+        yield node
+        for child in [node.right_child, node.left_child]:
+            if child:
+                stack.append(child)
+
+def iter_leafs(node: Node):
+    """Takes a node of a tree/subtree and yields 
+    all the leaf nodes below that node from left to right
+
+    :param node: The root/subroot node of the tree/subtree to extract leafs
+    :type node: Node
+    :return: A generator of all leaf nodes found below the node
+    including the node if it is a leaf node
+    :rtype: generator
+    """
+
+    for node in iter_nodes(node):
+        if node.is_leaf():
+            yield from leaf_nodes(node)
+
 def extract_leafs(node: Node):
     """Takes a node of a tree/subtree and returns 
     all the leaf nodes below that node
@@ -138,14 +240,101 @@ def extract_leafs(node: Node):
     :rtype: list
     """
 
-    leafs = []
-    if node.is_leaf():
-        leafs.append(node)
-    else:
-        for child in [node.left_child, node.right_child]:
-            if child:
-                leafs = leafs + extract_leafs(child)
-    return leafs
+    return list(iter_leafs(node))
+
+def leaf_nodes(node: Node, region = None):
+    """Takes a leaf node and returns a leaf node for every datapoint 
+    of the leaf that is inside the region. The datapoints of a bucket
+    leaf are checked with one vectorized test and they are returned
+    as new single datapoint leaf nodes
+
+    :param node: The leaf node
+    :type node: Node
+    :param region: The region that the datapoints should be in.
+    If None all the datapoints are returned, defaults to None
+    :type region: list, optional
+    :return: A list of single datapoint leaf nodes
+    :rtype: list
+    """
+
+    if node.datapoints is None:
+        if region is None or node.datapoint.in_range(region):
+            return [node]
+        return []
+
+    datapoints = node.datapoints
+    if region is not None:
+        low, high = region_bounds(region, node.bucket.shape[1])
+        inside = np.all((node.bucket >= low) & (node.bucket <= high), axis=1)
+        datapoints = [datapoints[i] for i in np.flatnonzero(inside)]
+    return [Node(dp.vector[node.axis], node.axis, datapoint = dp) for dp in datapoints]
+
+def aggregate_payloads(datapoints):
+    """Calculates the aggregates of the datapoints' payloads. 
+    Datapoints without payload are skipped
+
+    :param datapoints: The datapoints to aggregate
+    :type datapoints: list
+    :return: A dictionary with the number of payloads 'n' 
+    and their 'sum', 'min' and 'max'
+    :rtype: dict
+    """
+
+    payloads = [dp.payload for dp in datapoints if dp.payload is not None]
+    return {'n': len(payloads), 'sum': sum(payloads), 
+            'min': min(payloads, default=None), 'max': max(payloads, default=None)}
+
+def merge_aggregates(aggregates):
+    """Merges payload aggregates of disjoint groups of datapoints
+
+    :param aggregates: The aggregates to merge
+    :type aggregates: list
+    :return: The aggregates of all the groups
+    :rtype: dict
+    """
+
+    merged = {'n': 0, 'sum': 0, 'min': None, 'max': None}
+    for a in aggregates:
+        merged['n'] += a['n']
+        merged['sum'] += a['sum']
+        for key, pick in [('min', min), ('max', max)]:
+            if a[key] is not None:
+                merged[key] = a[key] if merged[key] is None else pick(merged[key], a[key])
+    return merged
+
+def aggregate_value(aggregates, fn):
+    """Returns one value of the aggregates
+
+    :param aggregates: Aggregates as returned by aggregate_payloads()
+    :type aggregates: dict
+    :param fn: One of 'sum', 'mean', 'min' or 'max'
+    :type fn: str
+    :raises ValueError: fn is not supported
+    :return: The value or None if there are no payloads for 'mean', 'min' and 'max'
+    :rtype: float
+    """
+
+    if fn == 'mean':
+        return aggregates['sum']/aggregates['n'] if aggregates['n'] else None
+    if fn not in ['sum', 'min', 'max']:
+        raise ValueError('fn should be one of sum, mean, min, max')
+    return aggregates[fn]
+
+def aggregate_keys(fn):
+    """Returns the aggregates that aggregate_value() needs besides the count 'n'
+
+    :param fn: One of 'sum', 'mean', 'min' or 'max', 'count' for none 
+    of them or None for all of them
+    :type fn: str
+    :return: The keys of the aggregates
+    :rtype: tuple
+    """
+
+    if fn is None:
+        return ('sum', 'min', 'max')
+    if fn == 'count':
+        return ()
+    return ('sum',) if fn == 'mean' else (fn,)
 
 def calc_mbr(datapoints):
     """Calculate the minimum bounding rectangle that contains the datapoints
@@ -239,9 +428,110 @@ def intersection(region_a, region_b):
 
     return new_region
 
+def euclidean_distance(a, b):
+    return math.dist(a, b)
+
+def manhattan_distance(a, b):
+    return sum(abs(x - y) for x, y in zip(a, b))
+
+def cosine_distance(a, b):
+    """Calculates the cosine distance 1 - cos(a, b) of 2 vectors.
+    A zero vector has zero similarity with every vector
+
+    :param a: The first vector
+    :type a: list
+    :param b: The second vector
+    :type b: list
+    :return: The cosine distance. It ranges from 0 to 2
+    :rtype: float
+    """
+
+    norms = math.hypot(*a)*math.hypot(*b)
+    if norms == 0:
+        return 1.0
+    return 1 - sum(x*y for x, y in zip(a, b))/norms
+
+distances = {
+    'euclidean': euclidean_distance,
+    'manhattan': manhattan_distance,
+    'cosine': cosine_distance}
+
+def get_distance(metric):
+    """Returns the distance function of the metric
+
+    :param metric: One of 'euclidean', 'manhattan' or 'cosine'
+    :type metric: str
+    :raises ValueError: The metric is not supported
+    :return: The distance function
+    :rtype: callable
+    """
+
+    if metric not in distances:
+        raise ValueError('metric should be one of ' + ', '.join(distances))
+    return distances[metric]
+
+def region_distance(region, point, metric = 'euclidean'):
+    """Calculates a lower bound of the distance between the point 
+    and every point inside the region. For the euclidean and manhattan
+    metrics it is the distance to the nearest point of the region
+
+    :param region: The region in the form [[x1,x2],[y1,y2],[z1,z2],...]
+    with every axis bounds sorted
+    :type region: list
+    :param point: The query point
+    :type point: list
+    :param metric: One of 'euclidean', 'manhattan' or 'cosine', defaults to 'euclidean'
+    :type metric: str, optional
+    :return: The lower bound of the distance
+    :rtype: float
+    """
+
+    gaps = [max(low - x, 0, x - high) for x, (low, high) in zip(point, region)]
+    if metric == 'euclidean':
+        return math.hypot(*gaps)
+    if metric == 'manhattan':
+        return sum(gaps)
+
+    # cosine: bound the best similarity by the largest dot product in the region
+    # divided by the smallest (or largest if it is negative) norm in the region
+    point_norm = math.hypot(*point)
+    if point_norm == 0:
+        return 1.0
+    max_dot = sum(x*high if x > 0 else x*low for x, (low, high) in zip(point, region))
+    min_norm = math.hypot(*[max(low, 0, -high) for low, high in region])
+    max_norm = math.hypot(*[max(abs(low), abs(high)) for low, high in region])
+    if min_norm == 0:
+        similarity = 1.0 if max_dot > 0 else 0.0
+    elif max_dot > 0:
+        similarity = min(1.0, max_dot/(point_norm*min_norm))
+    else:
+        similarity = max_dot/(point_norm*max_norm)
+    return 1 - similarity
+
+def region_bounds(region, dimensions):
+    """Converts a region to arrays with the lower and upper bound of every axis.
+    Axes that the region does not restrict get infinite bounds
+
+    :param region: The region in the form [[x1,x2],[y1,y2],[z1,z2],...]
+    :type region: list
+    :param dimensions: The number of dimensions of the returned bounds
+    :type dimensions: int
+    :return: The lower and the upper bounds
+    :rtype: tuple
+    """
+
+    low = np.full(dimensions, -np.inf)
+    high = np.full(dimensions, np.inf)
+    for axis in range(len(region)):
+        low[axis] = min(region[axis])
+        high[axis] = max(region[axis])
+    return low, high
+
 def compress(datapoints):
-    """Groups points with same coordinates into one Datapoint that
-    includes all points ids to avoid duplicate points
+    """Groups points with same coordinates into one Datapoint to avoid 
+    duplicate points. The first datapoint of every position is kept and 
+    its count is increased by the count of every duplicate. The grouping 
+    uses a PointIndex so it takes O(n) time
 
     :param datapoints: The input datapoints list to compress
     :type datapoints: list
@@ -249,22 +539,56 @@ def compress(datapoints):
     :rtype: list
     """    
 
-    length = len(datapoints)
-    i = 0
-    j = length - 1
-    while i < length:
-        while j > i:
-            if datapoints[i].vector == datapoints[j].vector:
-                datapoints[i].id += ", " + datapoints[j].id
-                del datapoints[j]
-                length -= 1
-                i -= 1
-                break
-            j -= 1
-        j = length - 1 
-        i += 1
+    index = PointIndex()
+    for datapoint in datapoints:
+        first = index.get(datapoint.vector)
+        if first is None:
+            index.add(datapoint)
+        else:
+            first.count += datapoint.count
         
-    return datapoints
+    return list(index)
+
+class PointIndex():
+    """Hash index of datapoints by their coordinates for O(1) exact lookups.
+    It keeps one datapoint for every position
+
+    :param datapoints: The datapoints to add, defaults to None
+    :type datapoints: list, optional
+    """
+
+    def __init__(self, datapoints: list = None):
+        self.points = {}
+        for datapoint in datapoints or []:
+            self.add(datapoint)
+
+    def add(self, datapoint: Datapoint) -> bool:
+        """Adds the datapoint if there is no datapoint in its position
+
+        :return: True if the datapoint was added else False
+        :rtype: bool
+        """
+
+        key = tuple(datapoint.vector)
+        if key in self.points:
+            return False
+        self.points[key] = datapoint
+        return True
+
+    def get(self, point: list) -> Datapoint:
+        return self.points.get(tuple(point))
+
+    def remove(self, point: list) -> Datapoint:
+        return self.points.pop(tuple(point), None)
+
+    def __contains__(self, point) -> bool:
+        return tuple(point) in self.points
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def __iter__(self):
+        return iter(self.points.values())
 
 def rangetree_space_complexity(n, factor=3, dimensions=2): #Bernard Chazelle complexity
     base = math.log(n, 2)/math.log(math.log(n,2),2) 